@@ -0,0 +1,56 @@
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+
+
+def percentiles(samples):
+    """Summarizes latencies
+    Args:
+        samples (list): Latencies in seconds
+    Returns:
+        dict: mean, p50, p95 and p99 in milliseconds
+    """
+    if len(samples) < 2:
+        value = samples[0] * 1000 if samples else 0.0
+        return {"mean": value, "p50": value, "p95": value, "p99": value}
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "mean": statistics.fmean(samples) * 1000,
+        "p50": cuts[49] * 1000,
+        "p95": cuts[94] * 1000,
+        "p99": cuts[98] * 1000,
+    }
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path, results):
+    """Writes benchmark results with the environment they were measured in"""
+    results = dict(
+        results,
+        commit=git_commit(),
+        python=platform.python_version(),
+        machine=platform.machine(),
+    )
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    return results
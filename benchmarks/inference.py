@@ -0,0 +1,227 @@
+"""Benchmarks the scoring path on the bundled review datasets
+
+    python -m benchmarks.inference --output bench_inference.json
+
+Reports cold-start time, per-review latency percentiles of predict, throughput
+of predict_batch at several batch sizes and the peak RSS of the process. Compare
+the JSON output across commits or RAPPORTCARD_BACKEND values.
+
+    python -m benchmarks.inference --tune --output bench_tune.json
+
+instead scores the reviews through LocalScorer under every combination of torch
+intra-op threads and executor concurrency that fits the cores, each in a fresh
+process, and reports the one with the highest throughput.
+"""
+
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from benchmarks.common import peak_rss_mb, percentiles, write_results
+from prototype.dataset import read_raw
+from utils import config
+
+DATASETS = [
+    "./prototype/dataset/reviews_train.raw",
+    "./prototype/dataset/reviews_test.raw",
+]
+
+
+def load_reviews(paths=DATASETS):
+    """Reads the distinct sentences of .raw datasets, in order"""
+    reviews = []
+    for path in paths:
+        reviews.extend(sentence for sentence, _, _ in read_raw(path))
+    return list(dict.fromkeys(reviews))
+
+
+def bench_latency(head, reviews):
+    latencies = []
+    for review in reviews:
+        started = time.perf_counter()
+        head.predict(review)
+        latencies.append(time.perf_counter() - started)
+    return percentiles(latencies)
+
+
+def bench_throughput(head, reviews, batch_size):
+    started = time.perf_counter()
+    head.predict_batch(reviews, batch_size=batch_size)
+    return len(reviews) / (time.perf_counter() - started)
+
+
+def run(reviews, batch_sizes):
+    from utils.inference_executor import configure_threads
+
+    results = {"backend": config.INFERENCE_BACKEND, "reviews": len(reviews)}
+    results["torch_threads"], results["torch_interop_threads"] = configure_threads()
+
+    started = time.perf_counter()
+    from prototype.model import ReviewSentiment
+    from bias_prototype.model import BiasSentiment
+
+    heads = [ReviewSentiment(), BiasSentiment()]
+    results["cold_start_s"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    heads[0].predict(reviews[0])
+    results["first_prediction_s"] = time.perf_counter() - started
+
+    results["heads"] = {}
+    for head in heads:
+        results["heads"][type(head).__name__] = {
+            "latency_ms": bench_latency(head, reviews),
+            "throughput_rps": {
+                str(size): bench_throughput(head, reviews, size) for size in batch_sizes
+            },
+        }
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def tune_settings(cores, threads=None, concurrency=None):
+    """Lists the (threads, concurrency) pairs to try
+    Args:
+        cores (int): Cores the scoring process may use
+        threads (list, optional): Intra-op thread counts. Defaults to powers of
+        two up to cores, and cores.
+        concurrency (list, optional): Executor limits. Defaults to the same.
+    Returns:
+        arr: Pairs whose threads * concurrency fits the cores
+    """
+    sizes = [1]
+    while sizes[-1] * 2 <= cores:
+        sizes.append(sizes[-1] * 2)
+    if sizes[-1] != cores:
+        sizes.append(cores)
+    return [
+        (t, c) for t in threads or sizes for c in concurrency or sizes if t * c <= cores
+    ]
+
+
+def measure_setting(reviews, threads, interop_threads, concurrency, batch_size):
+    """Scores reviews through LocalScorer with concurrency clients
+    Runs in its own process, since torch fixes its inter-op pool on first use.
+    Returns:
+        dict: The setting, its throughput and batch latency percentiles
+    """
+    from utils.inference_executor import InferenceExecutor, configure_threads
+    from utils.inference_server import LocalScorer
+    from utils.prediction_cache import PredictionCache
+
+    threads, interop_threads = configure_threads(threads, interop_threads)
+    # A memory-only cache that keeps nothing, so every batch runs the models
+    scorer = LocalScorer(
+        cache=PredictionCache(None, 0), executor=InferenceExecutor(concurrency)
+    )
+    scorer.score(reviews[:batch_size])
+
+    batches = queue.Queue()
+    for i in range(0, len(reviews), batch_size):
+        batches.put(reviews[i : i + batch_size])
+    latencies = []
+
+    def client():
+        while True:
+            try:
+                batch = batches.get_nowait()
+            except queue.Empty:
+                return
+            batch_started = time.perf_counter()
+            scorer.score(batch)
+            latencies.append(time.perf_counter() - batch_started)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        "threads": threads,
+        "interop_threads": interop_threads,
+        "concurrency": concurrency,
+        "throughput_rps": len(reviews) / elapsed,
+        "batch_latency_ms": percentiles(latencies),
+    }
+
+
+def tune(reviews, settings, interop_threads, batch_size):
+    results = {
+        "backend": config.INFERENCE_BACKEND,
+        "reviews": len(reviews),
+        "batch_size": batch_size,
+        "settings": [],
+    }
+    # spawn, so that every setting starts from fresh torch thread pools
+    context = multiprocessing.get_context("spawn")
+    for threads, concurrency in settings:
+        with context.Pool(1) as pool:
+            result = pool.apply(
+                measure_setting,
+                (reviews, threads, interop_threads, concurrency, batch_size),
+            )
+        print(
+            f"threads {result['threads']} concurrency {result['concurrency']}: "
+            f"{result['throughput_rps']:.1f} reviews/s, "
+            f"p95 batch {result['batch_latency_ms']['p95']:.0f}ms"
+        )
+        results["settings"].append(result)
+    results["best"] = max(results["settings"], key=lambda r: r["throughput_rps"])
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark review inference")
+    parser.add_argument("--output", default="bench_inference.json")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument(
+        "--limit", type=int, default=None, help="only replay the first N reviews"
+    )
+    parser.add_argument(
+        "--tune",
+        action="store_true",
+        help="find the fastest torch thread count and inference concurrency",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="cores the scoring process may use when tuning",
+    )
+    parser.add_argument("--threads", type=int, nargs="+", default=None)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=None)
+    parser.add_argument(
+        "--interop-threads", type=int, default=config.TORCH_INTEROP_THREADS
+    )
+    parser.add_argument("--tune-batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    reviews = load_reviews()[: args.limit]
+    if args.tune:
+        settings = tune_settings(args.cores, args.threads, args.concurrency)
+        results = write_results(
+            args.output,
+            tune(reviews, settings, args.interop_threads, args.tune_batch_size),
+        )
+        best = results["best"]
+        print(f"Wrote {args.output}, fastest on this host:")
+        print(f"RAPPORTCARD_TORCH_THREADS={best['threads']}")
+        print(f"RAPPORTCARD_TORCH_INTEROP_THREADS={best['interop_threads']}")
+        print(f"RAPPORTCARD_INFERENCE_CONCURRENCY={best['concurrency']}")
+    else:
+        results = write_results(args.output, run(reviews, args.batch_sizes))
+        print(f"Wrote {args.output}")
+        for name, head in results["heads"].items():
+            latency = head["latency_ms"]
+            print(
+                f"{name}: p50 {latency['p50']:.1f}ms p95 {latency['p95']:.1f}ms "
+                f"p99 {latency['p99']:.1f}ms, throughput {head['throughput_rps']}"
+            )
+        print(
+            f"Cold start {results['cold_start_s']:.2f}s, peak RSS {results['peak_rss_mb']:.0f}MB"
+        )
@@ -0,0 +1,357 @@
+"""Replays mixed user traffic against the web app and reports what it sustains
+
+    python -m benchmarks.load --users 16 --duration 60 --stub --output bench_load.json
+
+Every virtual user is a thread with its own Flask test client and a fresh
+account. It logs in, then picks actions at random by weight: searches, profile
+and review page views, and reviews taken through submission, status polling and
+the modify_review confirmation or cancellation. Teachers are read from the
+database and reviews from the bundled .raw datasets.
+
+The app runs against a copy of --db, so test.db is left untouched. With --stub
+the models are replaced by a scorer that only sleeps --stub-delay seconds per
+batch, which measures the web and database layers on their own; without it,
+reviews are scored by the real models in-process or through the model server.
+
+Reports throughput and latency percentiles per route, the time spent waiting
+for the SQLite write lock, requests that failed on a locked database and the
+queries that took the most time.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from benchmarks.common import peak_rss_mb, percentiles, write_results
+from benchmarks.inference import load_reviews
+from prototype.scorer import ReviewScore
+from utils import config
+
+# Relative weights of the actions a virtual user takes
+MIX = {
+    "search": 30,
+    "teacher": 30,
+    "reviews": 15,
+    "review": 15,
+    "login": 10,
+}
+
+PASSWORD = "load-test"
+
+
+class StubScorer:
+    """Stands in for InferenceClient without loading any model"""
+
+    def __init__(self, delay=0.0):
+        """
+        Args:
+            delay (float, optional): Seconds each batch takes. Defaults to 0.
+        """
+        self.delay = delay
+
+    def warm_up(self):
+        return 0.0
+
+    def score(self, reviews):
+        if self.delay:
+            time.sleep(self.delay)
+        # Alternates ratings so that some reviews take the modify_review flow
+        return [
+            ReviewScore(1 + len(review) % 5, "AI", 1, "Unbiased", 1.0, 1.0, [])
+            for review in reviews
+        ]
+
+
+class Recorder:
+    """Collects the outcome of every request, per route"""
+
+    def __init__(self, app):
+        self.adapter = app.url_map.bind("localhost")
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.lock_errors = defaultdict(int)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def route(self, method, path):
+        try:
+            endpoint, _ = self.adapter.match(urlsplit(path).path, method=method)
+        except Exception:
+            endpoint = "unmatched"
+        return endpoint
+
+    def request(self, client, method, path, **kwargs):
+        """Sends a request through client and records it
+        Returns:
+            Response: The response, or None if the app raised
+        """
+        route = self.route(method, path)
+        started = time.perf_counter()
+        try:
+            response = client.open(path, method=method, **kwargs)
+        except sqlite3.OperationalError as e:
+            response = None
+            error = "locked" if "locked" in str(e) else repr(e)
+        except Exception as e:
+            response = None
+            error = repr(e)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            if response is not None:
+                self.statuses[route][response.status_code] += 1
+            elif error == "locked":
+                self.lock_errors[route] += 1
+            else:
+                self.errors[route] += 1
+        return response
+
+    def report(self, seconds):
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            routes[route] = {
+                "requests": len(latencies),
+                "throughput_rps": len(latencies) / seconds,
+                "latency_ms": percentiles(latencies),
+                "statuses": {str(k): v for k, v in self.statuses[route].items()},
+                "lock_errors": self.lock_errors[route],
+                "errors": self.errors[route],
+            }
+        return routes
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, app, recorder, username, teachers, reviews, deadline, seed):
+        super().__init__(name=f"load-{username}", daemon=True)
+        self.client = app.test_client()
+        self.recorder = recorder
+        self.username = username
+        self.teachers = teachers
+        self.reviews = reviews
+        self.deadline = deadline
+        self.random = random.Random(seed)
+
+    def request(self, method, path, **kwargs):
+        return self.recorder.request(self.client, method, path, **kwargs)
+
+    def login(self):
+        self.request("GET", "/logout")
+        self.request(
+            "POST", "/login", data={"username": self.username, "password": PASSWORD}
+        )
+
+    def search(self):
+        _, name = self.random.choice(self.teachers)
+        words = name.split() or [""]
+        self.request("GET", f"/search?teacher={self.random.choice(words)[:4]}")
+
+    def teacher(self):
+        teacher_id, _ = self.random.choice(self.teachers)
+        self.request("GET", f"/teacher/{teacher_id}")
+
+    def reviews_page(self):
+        teacher_id, _ = self.random.choice(self.teachers)
+        self.request("GET", f"/teacher/{teacher_id}/reviews.json")
+
+    def review(self):
+        """Submits a review and follows it until it is settled, as a browser
+        would: status polling, then confirming or cancelling when asked to
+        """
+        teacher_id, _ = self.random.choice(self.teachers)
+        form = {
+            "review": self.random.choice(self.reviews),
+            "fallback_rating": str(self.random.randint(1, 5)),
+        }
+        response = self.request("POST", f"/teacher/{teacher_id}/review/add", data=form)
+        location = None
+        for _ in range(50):
+            if response is None:
+                return
+            if response.status_code == 200 and location and "/status" in location:
+                # Still pending; the page would refresh itself
+                time.sleep(0.1)
+                response = self.request("GET", location)
+                continue
+            if response.status_code != 302:
+                return
+            location = response.location
+            if "/status" in location:
+                response = self.request("GET", location)
+            elif "/modify/" in location:
+                self.request("GET", location)
+                modify = location.rsplit("/", 1)[0]
+                if self.random.random() < 0.5:
+                    response = self.request("POST", f"{modify}/1", data=form)
+                else:
+                    response = self.request("POST", f"{modify}/2")
+            else:
+                return
+
+    def run(self):
+        actions = {
+            "search": self.search,
+            "teacher": self.teacher,
+            "reviews": self.reviews_page,
+            "review": self.review,
+            "login": self.login,
+        }
+        names = list(MIX)
+        weights = [MIX[name] for name in names]
+        self.login()
+        while time.perf_counter() < self.deadline:
+            actions[self.random.choices(names, weights)[0]]()
+
+
+def run(main, users, duration, seed=0):
+    """Runs users virtual users for duration seconds
+    Args:
+        main (module): The imported main module, with its app and db
+        users (int): Concurrent virtual users
+        duration (float): Seconds to generate load for
+        seed (int, optional): Seed of the users' choices. Defaults to 0.
+    Returns:
+        dict: Results per route, write lock waits, top queries and scoring state
+    """
+    from utils import metrics
+
+    db = main.db
+    teachers = [
+        (row["teacher_id"], row["teacher_name"])
+        for row in db.get_records("list_teachers", (10000, 0))
+    ]
+    reviews = load_reviews()
+    usernames = [f"load-test-{seed}-{i}" for i in range(users)]
+    for username in usernames:
+        if db.get_user_by_name(username) is None:
+            db.create_user(username, PASSWORD)
+
+    recorder = Recorder(main.app)
+    locks_before = metrics.write_lock_seconds.snapshot().get((), (0, 0.0))
+    queries_before = metrics.query_seconds.snapshot()
+    started = time.perf_counter()
+    threads = [
+        VirtualUser(
+            main.app,
+            recorder,
+            username,
+            teachers,
+            reviews,
+            started + duration,
+            f"{seed}-{i}",
+        )
+        for i, username in enumerate(usernames)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    routes = recorder.report(elapsed)
+    locks = metrics.write_lock_seconds.snapshot().get((), (0, 0.0))
+    transactions = locks[0] - locks_before[0]
+    lock_wait = locks[1] - locks_before[1]
+    queries = []
+    for (query,), (count, total) in metrics.query_seconds.snapshot().items():
+        before_count, before_total = queries_before.get((query,), (0, 0.0))
+        if count > before_count:
+            queries.append(
+                {
+                    "query": query,
+                    "count": count - before_count,
+                    "total_ms": (total - before_total) * 1000,
+                }
+            )
+    queries.sort(key=lambda q: q["total_ms"], reverse=True)
+    requests = sum(route["requests"] for route in routes.values())
+    return {
+        "users": users,
+        "duration_s": elapsed,
+        "requests": requests,
+        "throughput_rps": requests / elapsed,
+        "routes": routes,
+        "write_lock": {
+            "transactions": transactions,
+            "wait_s": lock_wait,
+            "mean_wait_ms": lock_wait / transactions * 1000 if transactions else 0.0,
+            "locked_errors": sum(route["lock_errors"] for route in routes.values()),
+        },
+        "top_queries": queries[:10],
+        "scoring_backlog": db.count_queued_jobs(),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the web app")
+    parser.add_argument("--output", default="bench_load.json")
+    parser.add_argument(
+        "--db", default="test.db", help="database to copy and seed from"
+    )
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--stub", action="store_true", help="replace the models with a stub scorer"
+    )
+    parser.add_argument(
+        "--stub-delay",
+        type=float,
+        default=0.0,
+        help="seconds the stub scorer takes per batch",
+    )
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="rapportcard-load-")
+    database = os.path.join(workdir, "load.db")
+    shutil.copyfile(args.db, database)
+    # main opens config.DATABASE at import. utils.config was already imported
+    # through benchmarks.inference, so the environment alone is too late.
+    os.environ["RAPPORTCARD_DB"] = database
+    config.DATABASE = database
+    try:
+        import main
+
+        if main.db.uri != database:
+            raise RuntimeError(
+                f"The app opened {main.db.uri} instead of the copy at {database}"
+            )
+        # The test client cannot fill in CSRF tokens, and exceptions are
+        # counted rather than turned into error pages
+        main.app.config.update(WTF_CSRF_ENABLED=False, PROPAGATE_EXCEPTIONS=True)
+        if args.stub:
+            main.db.scorer = StubScorer(args.stub_delay)
+        main.warm_up()
+        results = run(main, args.users, args.duration, args.seed)
+        results["stub"] = args.stub
+        results = write_results(args.output, results)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"Wrote {args.output}")
+    print(
+        f"{results['requests']} requests in {results['duration_s']:.1f}s, "
+        f"{results['throughput_rps']:.1f}/s with {results['users']} users"
+    )
+    for route, result in results["routes"].items():
+        latency = result["latency_ms"]
+        print(
+            f"{route}: {result['throughput_rps']:.1f}/s p50 {latency['p50']:.1f}ms "
+            f"p95 {latency['p95']:.1f}ms p99 {latency['p99']:.1f}ms "
+            f"statuses {result['statuses']} locked {result['lock_errors']} "
+            f"errors {result['errors']}"
+        )
+    lock = results["write_lock"]
+    print(
+        f"Write lock: {lock['transactions']} transactions waited "
+        f"{lock['mean_wait_ms']:.2f}ms on average, {lock['locked_errors']} "
+        f"requests failed on a locked database"
+    )
+    print(f"Scoring backlog left: {results['scoring_backlog']}")
@@ -1,2 +1,19 @@
+from utils import config
+
 bind = "0.0.0.0:8080"
-workers = 2
\ No newline at end of file
+# Threaded workers keep login and search responsive while reviews are scored in
+# the background. gevent also works when models are served by
+# python -m utils.inference_server, since in-process inference would block the
+# event loop.
+worker_class = config.WEB_WORKER_CLASS
+workers = config.WEB_WORKERS
+threads = config.WEB_THREADS
+# Import the app once in the master. Models are loaded after the fork, since
+# torch's thread pools do not survive it.
+preload_app = True
+
+
+def post_fork(server, worker):
+    import main
+
+    main.warm_up()
@@ -1,4 +1,20 @@
-from flask import Flask, render_template, redirect, url_for, flash, request
+import threading
+import time
+
+_import_started = time.perf_counter()
+
+from flask import (
+    Flask,
+    Response,
+    render_template,
+    redirect,
+    url_for,
+    flash,
+    request,
+    jsonify,
+    g,
+    session,
+)
 from flask_login import (
     login_manager,
     LoginManager,
@@ -9,13 +25,65 @@ from flask_login import (
 )
 from utils.forms import LoginForm, SignUpForm
 from utils.user import User
-from utils.datastore import Datastore
+from utils.datastore import Datastore, REVIEW_PAGE_SIZE
+from utils.scoring_queue import ScoringWorker
+from utils import config, metrics
 
-db = Datastore("test.db")
+# One connection per request thread, plus the scoring worker's
+db = Datastore(config.DATABASE, pool_size=config.WEB_THREADS + 1)
 db.tables_init()
 
+_scoring_worker = None
+_scoring_worker_lock = threading.Lock()
+
+
+def get_scoring_worker():
+    """Retrieves this process' scoring worker, starting it if needed. Threads do
+    not survive a fork, so the worker is started per process rather than at
+    import time.
+    """
+    global _scoring_worker
+    with _scoring_worker_lock:
+        if _scoring_worker is None or not _scoring_worker.is_alive():
+            _scoring_worker = ScoringWorker(db)
+            _scoring_worker.start()
+        return _scoring_worker
+
+
+def warm_up():
+    """Starts the scoring worker and loads the models. Called by gunicorn's
+    post_fork hook so that the first review does not pay for model loading.
+    """
+    get_scoring_worker()
+    if config.WARM_UP:
+        app.logger.info("Warmed up models in %.2fs", db.warm_up())
+
+
 app = Flask(__name__)
-app.secret_key = "IDGAF"
+app.secret_key = config.SECRET_KEY
+db.init_app(app)
+
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+
+
+@app.after_request
+def record_request(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.finish_request(
+            route,
+            request.method,
+            response.status_code,
+            time.perf_counter() - started,
+            config.SLOW_REQUEST_SECONDS,
+        )
+    return response
+
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -24,11 +92,17 @@ login_manager.login_view = "login"
 
 @login_manager.user_loader
 def load_user(user_id):
-    user = db.get_user_by_id(user_id)
-    if user is None:
+    # The session cookie is signed, so a fresh payload needs no query
+    user = User.from_session(session.get("user"), user_id, config.SESSION_USER_TTL)
+    if user is not None:
+        return user
+    row = db.get_user_by_id(user_id)
+    if row is None:
+        session.pop("user", None)
         return None
-    else:
-        return User(int(user["id"]), user["username"], user["password"])
+    user = User(int(row["id"]), row["username"])
+    session["user"] = user.to_session()
+    return user
 
 
 @app.route("/")
@@ -46,12 +120,13 @@ def login():
         if user is None:
             flash("Login unsuccessful", category="danger")
         else:
-            user = load_user(user["id"])
+            user = User(int(user["id"]), user["username"], user["password"])
             if (
                 form.username.data == user.username
                 and form.password.data == user.password
             ):
                 login_user(user, remember=form.remember.data)
+                session["user"] = user.to_session()
                 return redirect(url_for("main"))
             else:
                 flash("Login unsuccessful.", category="danger")
@@ -62,6 +137,7 @@ def login():
 @login_required
 def logout():
     logout_user()
+    session.pop("user", None)
     return redirect(url_for("main"))
 
 
@@ -71,10 +147,8 @@ def signup():
         return redirect(url_for("main"))
     form = SignUpForm()
     if form.validate_on_submit():
-        user = db.get_user_by_name(form.username.data)
-        print(user)
-        if user is None:
-            db.create_user(form.username.data, form.password.data)
+        # The unique index decides, so concurrent signups cannot both succeed
+        if db.create_user(form.username.data, form.password.data):
             flash(f"User {form.username.data} created", category="success")
         else:
             flash(
@@ -84,30 +158,92 @@ def signup():
     return render_template("signup.html", form=form)
 
 
+SEARCH_PAGE_SIZE = 12
+
+
 @app.route("/search", methods=["GET", "POST"])
 @login_required
 def search():
-    if request.method == "POST":
-        teacher = request.form["teacher"]
-        result = db.search_teacher(teacher)
-        result = [result[i : i + 3] for i in range(0, len(result), 3)]
-        print(result)
-        return render_template("search.html", result=result)
-    else:
+    teacher = request.values.get("teacher")
+    if teacher is None:
         return render_template("search.html", result=[""])
+    page = max(request.args.get("page", 1, type=int), 1)
+    # One extra row tells whether there is a next page
+    result = db.search_teacher(
+        teacher, limit=SEARCH_PAGE_SIZE + 1, offset=(page - 1) * SEARCH_PAGE_SIZE
+    )
+    has_next = len(result) > SEARCH_PAGE_SIZE
+    result = result[:SEARCH_PAGE_SIZE]
+    result = [result[i : i + 3] for i in range(0, len(result), 3)]
+    return render_template(
+        "search.html", result=result, teacher=teacher, page=page, has_next=has_next
+    )
+
+
+def review_page_args():
+    before = request.args.get("before", type=int)
+    limit = min(max(request.args.get("limit", REVIEW_PAGE_SIZE, type=int), 1), 100)
+    return before, limit
 
 
 @app.route("/teacher/<teacher_id>", methods=["GET"])
 @login_required
 def teacher_profile(teacher_id=""):
     result = db.get_teacher_by_id(teacher_id)
-    reviews = db.get_review(teacher_id)
-    print(result["rating"])
-    print(round(result["rating"], None) * "⭐")
+    before, limit = review_page_args()
+    # Rows are streamed into the template rather than loaded up front
+    reviews = db.get_review_page(teacher_id, before, limit)
     result["bar"] = round(result["rating"], None) * "⭐"
+    aspects = db.get_aspect_summary(teacher_id)
     return render_template(
-        "teacher.html", teacher_id=teacher_id, result=result, reviews=reviews
+        "teacher.html",
+        teacher_id=teacher_id,
+        result=result,
+        reviews=reviews,
+        aspects=aspects,
+    )
+
+
+@app.route("/teacher/<teacher_id>/reviews.json", methods=["GET"])
+@login_required
+def teacher_reviews(teacher_id=""):
+    before, limit = review_page_args()
+    page = db.get_review_page(teacher_id, before, limit)
+    reviews = list(page)
+    return jsonify(reviews=reviews, next_before=page.next_key)
+
+
+@app.route("/teacher/<teacher_id>/aspects.json", methods=["GET"])
+@login_required
+def teacher_aspects(teacher_id=""):
+    head = request.args.get("head", "sentiment")
+    if head not in ("sentiment", "bias"):
+        return jsonify(error="head must be sentiment or bias"), 400
+    return jsonify(aspects=db.get_aspect_summary(teacher_id, head))
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    # Counters of this worker process only
+    cache = metrics.counter_family(
+        "rapportcard_record_cache_events_total",
+        "Record cache lookups and removals by kind of record",
+        ["kind", "event"],
+        [
+            ((kind, event), count)
+            for kind, counters in sorted(db.cache.stats().items())
+            if kind != "size"
+            for event, count in sorted(counters.items())
+        ],
     )
+    return Response(metrics.render([cache]), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/stats/cache", methods=["GET"])
+@login_required
+def cache_stats():
+    # Counters of this worker process only
+    return jsonify(db.cache.stats())
 
 
 @app.route("/teacher/<teacher_id>/review", methods=["GET"])
@@ -117,20 +253,81 @@ def review_teacher(teacher_id=""):
     return render_template("review.html", teacher_id=teacher_id, result=result)
 
 
+def fallback_rating_arg():
+    """Reads the manual rating of a review form
+    Returns:
+        int: The rating, or None unless it is a whole number from 1 to 5
+    """
+    rating = request.form.get("fallback_rating", type=int)
+    return rating if rating in range(1, 6) else None
+
+
+def reject_review(teacher_id, message, category, status, headers=None):
+    """Shows the review form again with a message, keeping the submitted text"""
+    flash(message, category=category)
+    result = db.get_teacher_by_id(teacher_id)
+    page = render_template(
+        "review.html",
+        teacher_id=teacher_id,
+        result=result,
+        review=request.form.get("review"),
+    )
+    return page, status, headers or {}
+
+
 @app.route("/teacher/<teacher_id>/review/add", methods=["POST"])
 @login_required
 def add_review(teacher_id=""):
+    # Checked before queueing, since a bad rating would only fail once scored
+    fallback_rating = fallback_rating_arg()
+    if fallback_rating is None:
+        return reject_review(
+            teacher_id, "Please pick a manual rating from 1 to 5.", "danger", 400
+        )
+    if db.count_queued_jobs() >= config.SCORING_BACKLOG_LIMIT:
+        # Turn the review away rather than let the backlog grow without bound
+        return reject_review(
+            teacher_id,
+            "Reviews are being scored slowly right now. Please submit again in a minute.",
+            "warning",
+            503,
+            {"Retry-After": "30"},
+        )
     review_id = db.add_review(
         teacher_id,
         current_user.id,
         5.0,
         request.form["review"],
-        request.form["fallback_rating"],
+        fallback_rating,
         "Verified",
     )
-    rating = db.get_review_by_id(review_id)["rating"]
+    get_scoring_worker().notify()
+    return redirect(
+        url_for(
+            "review_status",
+            teacher_id=teacher_id,
+            review_id=review_id,
+            fallback_rating=fallback_rating,
+        )
+    )
+
+
+@app.route("/teacher/<teacher_id>/review/<review_id>/status", methods=["GET"])
+@login_required
+def review_status(teacher_id="", review_id=""):
+    review = db.get_review_by_id(review_id)
+    if review is None:
+        return redirect(url_for("teacher_profile", teacher_id=teacher_id))
+    if review["flag"] == "Pending":
+        # The page refreshes itself until the scoring worker has caught up
+        result = db.get_teacher_by_id(teacher_id)
+        return render_template(
+            "pending_review.html", teacher_id=teacher_id, result=result
+        )
+
+    rating = review["rating"]
     aggregated = db.get_teacher_by_id(teacher_id)["rating"]
-    if abs(int(request.form["fallback_rating"]) - rating) > 1:
+    if abs(request.args.get("fallback_rating", rating, type=int) - rating) > 1:
         flash(
             "AI-determined rating and manual rating varies. Please re-confirm your submission."
         )
@@ -166,43 +363,36 @@ def add_review(teacher_id=""):
 def modify_review(modify_type="", teacher_id="", review_id="", message=""):
     if request.method == "POST":
         if modify_type == "1":  # AI calulcated does not match aggregated score
+            # Checked before the old review is deleted
+            fallback_rating = fallback_rating_arg()
+            if fallback_rating is None:
+                flash("Please pick a manual rating from 1 to 5.")
+                result = db.get_teacher_by_id(teacher_id)
+                page = render_template(
+                    "manual_review.html",
+                    teacher_id=teacher_id,
+                    review_id=review_id,
+                    result=result,
+                )
+                return page, 400
             db.delete_review(review_id)
             review_id = db.add_review(
                 teacher_id,
                 current_user.id,
                 5.0,
                 request.form["review"],
-                request.form["fallback_rating"],
+                fallback_rating,
                 "Verified",
             )
-            rating = db.get_review_by_id(review_id)["rating"]
-            aggregated = db.get_teacher_by_id(teacher_id)["rating"]
-            if abs(int(request.form["fallback_rating"]) - rating) > 1:
-                flash(
-                    "AI-determined rating and manual rating varies. Please re-confirm your submission."
+            get_scoring_worker().notify()
+            return redirect(
+                url_for(
+                    "review_status",
+                    teacher_id=teacher_id,
+                    review_id=review_id,
+                    fallback_rating=fallback_rating,
                 )
-                return redirect(
-                    url_for(
-                        "modify_review",
-                        teacher_id=teacher_id,
-                        review_id=review_id,
-                        modify_type=1,
-                    )
-                )
-
-            if aggregated + 1 <= rating or rating <= aggregated - 1:
-                flash(
-                    "Your previous review differs by a huge margin from the reviewee's ratings. Please try again. If not, cancel to proceed regardless."
-                )
-                return redirect(
-                    url_for(
-                        "modify_review",
-                        teacher_id=teacher_id,
-                        review_id=review_id,
-                        modify_type=1,
-                    )
-                )
-            return redirect(url_for("teacher_profile", teacher_id=teacher_id))
+            )
         elif modify_type == "2":  # Cancellation
             db.update_review(review_id)
             return redirect(url_for("teacher_profile", teacher_id=teacher_id))
@@ -213,5 +403,8 @@ def modify_review(modify_type="", teacher_id="", review_id="", message=""):
     )
 
 
+app.logger.info("Imported app in %.2fs", time.perf_counter() - _import_started)
+
 if __name__ == "__main__":
+    warm_up()
     app.run(debug=True)
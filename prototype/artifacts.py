@@ -0,0 +1,160 @@
+"""Local cache of the artifacts the models need from the network
+
+The cache directory (config.ARTIFACT_DIR) holds the bert-base-uncased tokenizer
+and embedding model and the senticnet lexicon, together with a manifest of their
+SHA-256 checksums. Populate it once with
+
+    python -m prototype.artifacts fetch
+
+and copy it to hosts without outbound network. With config.OFFLINE set, missing
+or corrupt artifacts raise ArtifactError instead of falling back to the network.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import urllib.request
+
+from utils import config
+
+if config.OFFLINE:
+    # Read by huggingface_hub and transformers when they are imported
+    os.environ["HF_HUB_OFFLINE"] = "1"
+    os.environ["TRANSFORMERS_OFFLINE"] = "1"
+
+EMBEDDING_MODEL = "bert-base-uncased"
+SENTICNET_URL = (
+    "https://storage.googleapis.com/sgnlp/models/sentic_gcn/senticnet.pickle"
+)
+MANIFEST = "manifest.json"
+
+_verified = set()
+
+
+class ArtifactError(Exception):
+    pass
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _files(root):
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            yield os.path.relpath(os.path.join(dirpath, filename), config.ARTIFACT_DIR)
+
+
+def load_manifest():
+    path = os.path.join(config.ARTIFACT_DIR, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def verify(name):
+    """Checks an artifact in the cache against the manifest
+    Args:
+        name (str): File or directory name inside the cache
+    Returns:
+        bool: Whether the artifact is cached. Checked artifacts are remembered
+        for the rest of the process.
+    Raises:
+        ArtifactError: If a cached file does not match its checksum
+    """
+    if name in _verified:
+        return True
+    path = os.path.join(config.ARTIFACT_DIR, name)
+    if not os.path.exists(path):
+        return False
+    manifest = load_manifest()
+    files = list(_files(path)) if os.path.isdir(path) else [name]
+    for file in files:
+        if file not in manifest:
+            raise ArtifactError(f"{file} is missing from the artifact manifest")
+        if _sha256(os.path.join(config.ARTIFACT_DIR, file)) != manifest[file]:
+            raise ArtifactError(f"Checksum mismatch for cached artifact {file}")
+    _verified.add(name)
+    return True
+
+
+def _resolve(name, remote):
+    if verify(name):
+        return os.path.join(config.ARTIFACT_DIR, name)
+    if config.OFFLINE:
+        raise ArtifactError(
+            f"{name} is not cached in {config.ARTIFACT_DIR} and offline mode is on. "
+            "Run python -m prototype.artifacts fetch on a connected host."
+        )
+    return remote
+
+
+def embedding_model():
+    """Retrieves where to load bert-base-uncased from
+    Returns:
+        str: Cached directory, or the hub name when online and not cached
+    """
+    return _resolve(EMBEDDING_MODEL, EMBEDDING_MODEL)
+
+
+def senticnet():
+    """Retrieves where to load the senticnet lexicon from
+    Returns:
+        str: Cached pickle, or its URL when online and not cached
+    """
+    return _resolve("senticnet.pickle", SENTICNET_URL)
+
+
+def fetch():
+    """Downloads every artifact into the cache and records their checksums"""
+    from sgnlp.models.sentic_gcn import (
+        SenticGCNBertEmbeddingConfig,
+        SenticGCNBertEmbeddingModel,
+        SenticGCNBertTokenizer,
+    )
+
+    os.makedirs(config.ARTIFACT_DIR, exist_ok=True)
+
+    model_dir = os.path.join(config.ARTIFACT_DIR, EMBEDDING_MODEL)
+    SenticGCNBertTokenizer.from_pretrained(EMBEDDING_MODEL).save_pretrained(model_dir)
+    embed_config = SenticGCNBertEmbeddingConfig.from_pretrained(EMBEDDING_MODEL)
+    SenticGCNBertEmbeddingModel.from_pretrained(
+        EMBEDDING_MODEL, config=embed_config
+    ).save_pretrained(model_dir)
+
+    # Download next to the target so the final move is atomic
+    with tempfile.NamedTemporaryFile(dir=config.ARTIFACT_DIR, delete=False) as tmp:
+        with urllib.request.urlopen(SENTICNET_URL) as response:
+            shutil.copyfileobj(response, tmp)
+    os.replace(tmp.name, os.path.join(config.ARTIFACT_DIR, "senticnet.pickle"))
+
+    manifest = {
+        file: _sha256(os.path.join(config.ARTIFACT_DIR, file))
+        for file in _files(config.ARTIFACT_DIR)
+        if file != MANIFEST
+    }
+    with open(os.path.join(config.ARTIFACT_DIR, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    _verified.clear()
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage cached model artifacts")
+    parser.add_argument("command", choices=["fetch", "verify"])
+    args = parser.parse_args()
+
+    if args.command == "fetch":
+        manifest = fetch()
+        print(f"Cached {len(manifest)} files in {config.ARTIFACT_DIR}")
+    else:
+        for name in (EMBEDDING_MODEL, "senticnet.pickle"):
+            print(f"{name}: {'ok' if verify(name) else 'not cached'}")
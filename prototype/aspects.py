@@ -0,0 +1,63 @@
+import os
+import re
+from collections import namedtuple
+
+AspectMatch = namedtuple("AspectMatch", ["aspect", "start", "end"])
+
+
+class AspectMatcher:
+    """Finds aspect terms in a sentence with a single compiled regex
+
+    Terms only match whole words, optionally followed by a plural suffix, so
+    "exam" matches "exams" but "man" does not match inside "management".
+    """
+
+    def __init__(self, aspects):
+        """
+        Args:
+            aspects (list): Aspect terms, matched case-insensitively
+        Raises:
+            ValueError: If aspects holds no term
+        """
+        self.aspects = [aspect.lower().strip() for aspect in aspects]
+        self.aspects = [aspect for aspect in self.aspects if aspect]
+        if not self.aspects:
+            # An empty alternation would match at every word boundary
+            raise ValueError("AspectMatcher needs at least one aspect term")
+        # Longest terms first so "grading" wins over "grade" at the same position
+        terms = sorted(set(self.aspects), key=len, reverse=True)
+        alternation = "|".join(re.escape(term) for term in terms)
+        self.pattern = re.compile(rf"\b({alternation})(?:e?s)?\b", re.IGNORECASE)
+
+    def find(self, sentence):
+        """Finds every aspect occurrence in one pass over the sentence
+        Args:
+            sentence (str): Text to search
+        Returns:
+            arr: AspectMatch per occurrence with its character offsets, in order
+        """
+        return [
+            AspectMatch(match.group(1).lower(), match.start(), match.end())
+            for match in self.pattern.finditer(sentence)
+        ]
+
+
+def load_aspects(model_dir, default):
+    """Reads the aspect vocabulary of a model
+    Args:
+        model_dir (str): Model directory, which may hold an aspects.txt with one
+        term per line
+        default (list): Vocabulary to use without aspects.txt
+    Returns:
+        arr: Aspect terms
+    Raises:
+        ValueError: If aspects.txt holds no term
+    """
+    path = os.path.join(model_dir, "aspects.txt")
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        aspects = [line.strip() for line in f if line.strip()]
+    if not aspects:
+        raise ValueError(f"{path} lists no aspect terms")
+    return aspects
@@ -0,0 +1,202 @@
+"""Alternative CPU inference backends for the embedding model and GCN heads
+
+The backend is chosen with config.INFERENCE_BACKEND:
+
+- ``eager``: plain float32 PyTorch, the reference
+- ``quantized``: dynamic int8 quantization of every Linear layer of the
+  embedding model and the heads. Expected to agree with eager on at least 95%
+  of the aspect labels of prototype/dataset/reviews_test.raw.
+- ``onnx``: the embedding model runs in ONNX Runtime, the heads stay in eager
+  PyTorch since their graph convolution depends on per-sample lengths. Expected
+  to agree with eager on at least 99% of the labels.
+
+Export and check a backend with
+
+    python -m prototype.backends export
+    python -m prototype.backends validate --backend onnx
+"""
+
+import argparse
+import os
+import sys
+
+import torch
+
+from prototype import artifacts
+from utils import config
+
+BACKENDS = ("eager", "quantized", "onnx")
+
+# Minimum share of labels that must match the eager backend
+TOLERANCE = {"eager": 1.0, "quantized": 0.95, "onnx": 0.99}
+
+
+def onnx_path():
+    return os.path.join(config.ARTIFACT_DIR, f"{artifacts.EMBEDDING_MODEL}.onnx")
+
+
+class OnnxEmbeddingModel:
+    """Runs the exported embedding model in ONNX Runtime behind the interface
+    the preprocessor expects from SenticGCNBertEmbeddingModel
+    """
+
+    def __init__(self, path):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise ImportError(
+                "The onnx backend requires onnxruntime, pip install onnxruntime"
+            )
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"{path} does not exist, run python -m prototype.backends export"
+            )
+        # Same thread budget as the torch backends, see utils.inference_executor
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = config.TORCH_THREADS
+        options.inter_op_num_threads = config.TORCH_INTEROP_THREADS
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, input_ids, token_type_ids=None, **kwargs):
+        if token_type_ids is None:
+            token_type_ids = torch.zeros_like(input_ids)
+        (hidden,) = self.session.run(
+            ["last_hidden_state"],
+            {
+                "input_ids": input_ids.cpu().numpy(),
+                "token_type_ids": token_type_ids.cpu().numpy(),
+            },
+        )
+        return {"last_hidden_state": torch.from_numpy(hidden)}
+
+    def eval(self):
+        return self
+
+
+class _ExportedEmbedding(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, token_type_ids):
+        return self.model(input_ids, token_type_ids=token_type_ids)[0]
+
+
+def quantize(model):
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def optimize_embedding_model(model, backend):
+    """Converts the eager embedding model for the given backend
+    Args:
+        model (SenticGCNBertEmbeddingModel): Eager float32 model, None for onnx
+        which loads the exported file instead
+        backend (str): One of BACKENDS
+    Returns:
+        Callable with the interface of SenticGCNBertEmbeddingModel
+    """
+    if backend == "quantized":
+        return quantize(model)
+    if backend == "onnx":
+        return OnnxEmbeddingModel(onnx_path())
+    return model
+
+
+def optimize_head(model, backend):
+    if backend == "quantized":
+        return quantize(model)
+    return model
+
+
+def export_onnx(path=None):
+    """Exports the eager embedding model to ONNX
+    Args:
+        path (str, optional): Destination. Defaults to onnx_path().
+    """
+    from prototype.registry import get_embedding_model, get_tokenizer
+
+    path = path or onnx_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    encoded = get_tokenizer()(
+        "the teacher explains well", "teacher", return_tensors="pt"
+    )
+    torch.onnx.export(
+        _ExportedEmbedding(get_embedding_model("eager")).eval(),
+        (encoded["input_ids"], encoded["token_type_ids"]),
+        path,
+        input_names=["input_ids", "token_type_ids"],
+        output_names=["last_hidden_state"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "token_type_ids": {0: "batch", 1: "sequence"},
+            "last_hidden_state": {0: "batch", 1: "sequence"},
+        },
+        opset_version=14,
+    )
+
+
+def predict_labels(head, samples):
+    """Predicts the label of every (sentence, aspect) sample in one batch
+    Args:
+        head (SentimentHead): Head to run
+        samples (list): (sentence, aspect, polarity) tuples from read_raw
+    Returns:
+        arr: Predicted polarity per sample
+    """
+    processed_inputs = [
+        head.preprocessor._process_inputs(
+            [{"aspects": [aspect], "sentence": sentence.lower()}]
+        )[0]
+        for sentence, aspect, _ in samples
+    ]
+    with torch.no_grad():
+        processed_indices = head.preprocessor._process_indices(processed_inputs)
+        logits = head.model(processed_indices).logits
+    return [int(label) - 1 for label in logits.argmax(dim=-1)]
+
+
+def validate(backend, dataset):
+    """Compares a backend against eager on a .raw dataset
+    Returns:
+        bool: Whether every head is within TOLERANCE[backend]
+    """
+    from prototype.dataset import read_raw
+    from prototype.model import ReviewSentiment
+    from bias_prototype.model import BiasSentiment
+
+    samples = list(read_raw(dataset))
+    ok = True
+    for head_class in (ReviewSentiment, BiasSentiment):
+        reference = predict_labels(head_class(backend="eager"), samples)
+        candidate = predict_labels(head_class(backend=backend), samples)
+        agreement = sum(a == b for a, b in zip(reference, candidate)) / len(samples)
+        accuracy = sum(
+            label == polarity for label, (_, _, polarity) in zip(candidate, samples)
+        ) / len(samples)
+        print(
+            f"{head_class.__name__}: {agreement:.1%} agreement with eager, "
+            f"{accuracy:.1%} accuracy on {len(samples)} samples"
+        )
+        ok = ok and agreement >= TOLERANCE[backend]
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and validate backends")
+    parser.add_argument("command", choices=["export", "validate"])
+    parser.add_argument("--backend", choices=BACKENDS, default="quantized")
+    parser.add_argument("--dataset", default="./prototype/dataset/reviews_test.raw")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_onnx()
+        print(f"Exported {onnx_path()}")
+    elif not validate(args.backend, args.dataset):
+        print(
+            f"{args.backend} is outside its tolerance of {TOLERANCE[args.backend]:.0%}"
+        )
+        sys.exit(1)
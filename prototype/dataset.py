@@ -0,0 +1,16 @@
+def read_raw(path):
+    """Reads a dataset in the .raw format, where every sample spans three lines:
+    the sentence with its aspect replaced by $T$, the aspect, and the polarity
+    (-1, 0 or 1)
+    Args:
+        path (str): Path to the .raw file
+    Yields:
+        tup: (sentence, aspect, polarity) with the aspect put back in place
+    """
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    for i in range(0, len(lines) - 2, 3):
+        masked, aspect, polarity = lines[i : i + 3]
+        if not masked:
+            continue
+        yield masked.replace("$T$", aspect), aspect, int(polarity)
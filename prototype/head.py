@@ -0,0 +1,243 @@
+import os
+from collections import namedtuple
+
+import torch
+from sgnlp.models.sentic_gcn import (
+    SenticGCNBertConfig,
+    SenticGCNBertModel,
+    SenticGCNBertPostprocessor,
+)
+from sgnlp.models.sentic_gcn.modeling import SenticGCNBertModelOutput
+
+from prototype import backends
+from prototype.aspects import AspectMatcher, load_aspects
+from prototype.registry import get_preprocessor
+from utils import config
+from utils.metrics import inference_seconds
+
+# label is -1, 0 or 1 as in the postprocessor output, confidence the softmax
+# probability of that label
+AspectScore = namedtuple("AspectScore", ["aspect", "label", "confidence"])
+
+
+class SentimentHead:
+    """A SenticGCN classification head on top of the shared BERT embeddings
+
+    Subclasses only provide the directory holding their fine-tuned weights and
+    the default aspect vocabulary they score. An aspects.txt in the model
+    directory overrides the default.
+    """
+
+    def __init__(self, model_dir, aspects, backend=None):
+        """Loads the GCN head stored in model_dir
+
+        Args:
+            model_dir (str): Directory containing config.json and pytorch_model.bin
+            aspects (list): Default aspect terms this head scores
+            backend (str, optional): Inference backend, see prototype.backends.
+            Defaults to config.INFERENCE_BACKEND.
+        """
+        self.backend = backend or config.INFERENCE_BACKEND
+        self.aspects = load_aspects(model_dir, aspects)
+        self.matcher = AspectMatcher(self.aspects)
+
+        self.config = SenticGCNBertConfig.from_pretrained(f"{model_dir}/config.json")
+
+        weights = f"{model_dir}/pytorch_model.bin"
+        self.model = SenticGCNBertModel.from_pretrained(
+            weights,
+            config=self.config,
+        )
+        self.model = backends.optimize_head(self.model.eval(), self.backend)
+        # Changes whenever the fine-tuned weights are replaced, which invalidates
+        # cached predictions
+        stat = os.stat(weights)
+        self.version = f"{model_dir}@{stat.st_size}-{stat.st_mtime_ns}:{self.backend}"
+
+        self.preprocessor = get_preprocessor(self.backend)
+        self.tokenizer = self.preprocessor.tokenizer
+        self.embed_model = self.preprocessor.embedding_model
+
+        self.postprocessor = SenticGCNBertPostprocessor()
+        self.name = type(self).__name__
+
+    def timed(self, stage):
+        """Times an inference stage of this head, see utils.metrics"""
+        return inference_seconds.time(self.name, stage)
+
+    def expand(self, sentence, matches=None):
+        """Builds one preprocessor input per aspect occurrence in the sentence
+        Args:
+            sentence (str): Review text
+            matches (list, optional): AspectMatch per occurrence in the
+            lowercased, stripped sentence, when aspects were already detected.
+            Defaults to detecting them.
+        Returns:
+            arr: Preprocessed inputs, empty if the sentence contains no aspect
+        """
+        full_text = sentence.lower().strip()
+        if matches is None:
+            matches = self.matcher.find(full_text)
+        if not matches:
+            return []
+        aspect_in_sentence = list(dict.fromkeys(match.aspect for match in matches))
+        inputs = self.preprocessor._process_inputs(
+            [{"aspects": aspect_in_sentence, "sentence": full_text}]
+        )
+        # The preprocessor locates aspects by substring search, so drop the
+        # occurrences that the matcher rejected, such as "man" in "management"
+        occurrences = {
+            (match.aspect, full_text[: match.start].strip()) for match in matches
+        }
+        return [i for i in inputs if (i.aspect, i.left_text.strip()) in occurrences]
+
+    def preprocess(self, sentence):
+        """Detects aspects and runs tokenization and the BERT embedding pass.
+        The result can be passed to predict_processed of any head sharing the
+        registry preprocessor.
+        Args:
+            sentence (str): Review text
+        Returns:
+            tup: (processed_inputs, processed_indices), or None if the sentence
+            contains no known aspect
+        """
+        with self.timed("tokenize"):
+            processed_inputs = self.expand(sentence)
+        if not processed_inputs:
+            return None
+
+        with torch.no_grad(), self.timed("embed"):
+            processed_indices = self.preprocessor._process_indices(processed_inputs)
+        return processed_inputs, processed_indices
+
+    def preprocess_batch(self, sentences, matches=None):
+        """Preprocesses many reviews with a single BERT embedding pass
+        Args:
+            sentences (list): Review texts
+            matches (list, optional): Output of find per sentence. Defaults to
+            detecting aspects.
+        Returns:
+            tup: (processed_inputs, processed_indices, counts) where counts[i] is
+            the number of aspect inputs produced by sentences[i], or None if no
+            sentence contains a known aspect
+        """
+        processed_inputs = []
+        counts = []
+        if matches is None:
+            matches = [None] * len(sentences)
+        with self.timed("tokenize"):
+            for sentence, sentence_matches in zip(sentences, matches):
+                # Expanding per sentence keeps track of which aspect inputs belong
+                # to which review, since the postprocessor would merge equal
+                # sentences
+                sentence_inputs = self.expand(sentence, sentence_matches)
+                counts.append(len(sentence_inputs))
+                processed_inputs.extend(sentence_inputs)
+        if not processed_inputs:
+            return None
+
+        with torch.no_grad(), self.timed("embed"):
+            processed_indices = self.preprocessor._process_indices(processed_inputs)
+        return processed_inputs, processed_indices, counts
+
+    def predict_processed(self, processed):
+        """Runs the GCN head over already preprocessed inputs
+        Args:
+            processed (tup): Output of preprocess
+        Returns:
+            arr: Postprocessed outputs, empty if there were no aspects
+        """
+        if processed is None:
+            return []
+        processed_inputs, processed_indices = processed
+        with torch.no_grad(), self.timed("gcn"):
+            raw_outputs = self.model(processed_indices)
+
+        with self.timed("postprocess"):
+            post_outputs = self.postprocessor(
+                processed_inputs=processed_inputs, model_outputs=raw_outputs
+            )
+
+        return post_outputs
+
+    def predict_batch_processed(self, processed, size):
+        """Runs the GCN head once over a preprocessed batch
+        Args:
+            processed (tup): Output of preprocess_batch
+            size (int): Number of sentences in the batch
+        Returns:
+            arr: One postprocessed output per sentence, in the format of predict
+        """
+        if processed is None:
+            return [[] for _ in range(size)]
+        processed_inputs, processed_indices, counts = processed
+        with torch.no_grad(), self.timed("gcn"):
+            logits = self.model(processed_indices).logits
+
+        outputs = []
+        start = 0
+        with self.timed("postprocess"):
+            for count in counts:
+                if count == 0:
+                    outputs.append([])
+                    continue
+                end = start + count
+                outputs.append(
+                    self.postprocessor(
+                        processed_inputs=processed_inputs[start:end],
+                        model_outputs=SenticGCNBertModelOutput(
+                            logits=logits[start:end]
+                        ),
+                    )
+                )
+                start = end
+        return outputs
+
+    def score_aspects_processed(self, processed, size):
+        """Runs the GCN head once over a preprocessed batch, keeping the label
+        and confidence of every aspect occurrence
+        Args:
+            processed (tup): Output of preprocess_batch
+            size (int): Number of sentences in the batch
+        Returns:
+            arr: AspectScore list per sentence, empty without aspects
+        """
+        if processed is None:
+            return [[] for _ in range(size)]
+        processed_inputs, processed_indices, counts = processed
+        with torch.no_grad(), self.timed("gcn"):
+            logits = self.model(processed_indices).logits
+
+        with self.timed("postprocess"):
+            confidences, labels = torch.softmax(logits, dim=-1).max(dim=-1)
+            scores = [
+                AspectScore(processed_input.aspect, label - 1, confidence)
+                for processed_input, label, confidence in zip(
+                    processed_inputs, labels.tolist(), confidences.tolist()
+                )
+            ]
+        outputs = []
+        start = 0
+        for count in counts:
+            outputs.append(scores[start : start + count])
+            start += count
+        return outputs
+
+    def predict(self, sentence):
+        return self.predict_processed(self.preprocess(sentence))
+
+    def predict_batch(self, sentences, batch_size=32):
+        """Scores many reviews, batch_size reviews per forward pass
+        Args:
+            sentences (list): Review texts
+            batch_size (int, optional): Reviews per forward pass. Defaults to 32.
+        Returns:
+            arr: One output per review, each in the format returned by predict
+        """
+        outputs = []
+        for i in range(0, len(sentences), batch_size):
+            chunk = sentences[i : i + batch_size]
+            outputs.extend(
+                self.predict_batch_processed(self.preprocess_batch(chunk), len(chunk))
+            )
+        return outputs
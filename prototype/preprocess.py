@@ -0,0 +1,123 @@
+import threading
+
+import numpy as np
+import torch
+from sgnlp.models.sentic_gcn import SenticGCNBertPreprocessor
+from sgnlp.models.sentic_gcn.utils import (
+    generate_dependency_adj_matrix,
+    pad_and_truncate,
+)
+
+
+class SharedSentencePreprocessor(SenticGCNBertPreprocessor):
+    """SenticGCNBertPreprocessor that does per-sentence work once per sentence
+
+    The stock preprocessor tokenizes and dependency-parses the whole sentence and
+    runs BERT once for every aspect occurrence. Here every string is tokenized
+    once per batch, each sentence is parsed once for all of its aspects, and BERT
+    runs once per distinct (sentence, aspect) pair, so repeated aspects and
+    repeated reviews share an embedding. The tensors produced are the same as the
+    stock preprocessor's.
+
+    Distinct aspects of one sentence still need their own BERT pass: the model
+    embeds "[CLS] sentence [SEP] aspect [SEP]", so every token's embedding
+    depends on the aspect through attention.
+
+    The tokenizer and spaCy pipeline are not meant to be shared between threads,
+    so building the indices is serialized while BERT passes of concurrent batches
+    may overlap.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+
+    def _tokenize(self, text):
+        return self.tokenizer(
+            text,
+            max_length=self.max_len,
+            padding="max_length",
+            truncation=True,
+            add_special_tokens=False,
+            return_tensors=None,
+            return_attention_mask=False,
+            return_token_type_ids=False,
+        )["input_ids"]
+
+    def _process_indices(self, data_batch):
+        """Builds the model input tensors for a batch of processed inputs
+        Args:
+            data_batch (list): SenticGCNBertData from _process_inputs
+        Returns:
+            arr: text, aspect and left indices, text embeddings and graphs, as
+            returned by SenticGCNBertPreprocessor._process_indices
+        """
+        tokens = {}
+        documents = {}
+        graphs = {}
+        # Row of each distinct (sentence, aspect) pair in the BERT batch
+        pairs = {}
+        bert_indices = []
+        segment_indices = []
+
+        def tokenize(text):
+            if text not in tokens:
+                tokens[text] = self._tokenize(text)
+            return tokens[text]
+
+        all_text_indices = []
+        all_aspect_indices = []
+        all_left_indices = []
+        all_sdat_graph = []
+        rows = []
+        with self._lock:
+            for data in data_batch:
+                text_indices = tokenize(data.full_text)
+                aspect_indices = tokenize(data.aspect)
+                pair = (data.full_text, data.aspect)
+                if pair not in pairs:
+                    pairs[pair] = len(pairs)
+                    bert_indices.append(tokenize(data.full_text_with_bert_tokens))
+                    # Same lengths as the stock preprocessor computes from the
+                    # tokenizer's lists
+                    text_len = np.sum(text_indices != 0)
+                    aspect_len = np.sum(aspect_indices != 0)
+                    segment_indices.append(
+                        pad_and_truncate(
+                            [0] * (text_len + 2) + [1] * (aspect_len + 1), self.max_len
+                        )
+                    )
+                    if data.full_text not in documents:
+                        documents[data.full_text] = self.spacy_pipeline(data.full_text)
+                    document = documents[data.full_text]
+                    graph = generate_dependency_adj_matrix(
+                        data.full_text, data.aspect, self.senticnet, lambda _: document
+                    )
+                    graphs[pair] = np.pad(
+                        graph,
+                        (
+                            (0, self.max_len - graph.shape[0]),
+                            (0, self.max_len - graph.shape[0]),
+                        ),
+                        "constant",
+                    )
+                rows.append(pairs[pair])
+                all_text_indices.append(text_indices)
+                all_aspect_indices.append(aspect_indices)
+                all_left_indices.append(tokenize(data.left_text))
+                all_sdat_graph.append(graphs[pair])
+
+        embeddings = self.embedding_model(
+            torch.tensor(bert_indices).to(self.device),
+            token_type_ids=torch.tensor(np.array(segment_indices)).to(self.device),
+        )["last_hidden_state"]
+        if len(pairs) < len(data_batch):
+            embeddings = embeddings[torch.tensor(rows).to(self.device)]
+
+        return [
+            torch.tensor(all_text_indices).to(self.device),
+            torch.tensor(all_aspect_indices).to(self.device),
+            torch.tensor(all_left_indices).to(self.device),
+            embeddings,
+            torch.tensor(np.array(all_sdat_graph)).to(self.device),
+        ]
@@ -0,0 +1,88 @@
+"""Process-wide registry of the model components shared by every head.
+
+``ReviewSentiment`` and ``BiasSentiment`` are both SenticGCN heads on top of the
+same ``bert-base-uncased`` embedding model, so the tokenizer, embedding model and
+preprocessor are loaded once per process and backend and handed out from here.
+"""
+
+import threading
+
+from prototype import artifacts, backends
+from prototype.preprocess import SharedSentencePreprocessor
+from utils import config
+from sgnlp.models.sentic_gcn import (
+    SenticGCNBertEmbeddingConfig,
+    SenticGCNBertEmbeddingModel,
+    SenticGCNBertTokenizer,
+)
+
+_lock = threading.RLock()
+_registry = {}
+
+
+def get_tokenizer() -> SenticGCNBertTokenizer:
+    """Retrieves the shared BERT tokenizer, loading it on first use
+    Returns:
+        SenticGCNBertTokenizer: The process-wide tokenizer
+    """
+    with _lock:
+        if "tokenizer" not in _registry:
+            _registry["tokenizer"] = SenticGCNBertTokenizer.from_pretrained(
+                artifacts.embedding_model()
+            )
+        return _registry["tokenizer"]
+
+
+def get_embedding_model(backend=None) -> SenticGCNBertEmbeddingModel:
+    """Retrieves the shared BERT embedding model, loading it on first use
+    Args:
+        backend (str, optional): Inference backend. Defaults to
+        config.INFERENCE_BACKEND.
+    Returns:
+        SenticGCNBertEmbeddingModel: The process-wide embedding model, converted
+        for the backend
+    """
+    backend = backend or config.INFERENCE_BACKEND
+    with _lock:
+        if ("embed_model", backend) in _registry:
+            return _registry[("embed_model", backend)]
+        if backend == "onnx":
+            # Runs from the exported file alone; holding the PyTorch weights as
+            # well would cost more memory than eager
+            eager = None
+        elif ("embed_model", "eager") in _registry:
+            eager = _registry[("embed_model", "eager")]
+        else:
+            embed_config = SenticGCNBertEmbeddingConfig.from_pretrained(
+                artifacts.embedding_model()
+            )
+            eager = SenticGCNBertEmbeddingModel.from_pretrained(
+                artifacts.embedding_model(), config=embed_config
+            ).eval()
+            if backend == "eager":
+                _registry[("embed_model", "eager")] = eager
+        _registry[("embed_model", backend)] = backends.optimize_embedding_model(
+            eager, backend
+        )
+        return _registry[("embed_model", backend)]
+
+
+def get_preprocessor(backend=None) -> SharedSentencePreprocessor:
+    """Retrieves the shared preprocessor built on the shared tokenizer and
+    embedding model
+    Args:
+        backend (str, optional): Inference backend. Defaults to
+        config.INFERENCE_BACKEND.
+    Returns:
+        SharedSentencePreprocessor: The process-wide preprocessor of the backend
+    """
+    backend = backend or config.INFERENCE_BACKEND
+    with _lock:
+        if ("preprocessor", backend) not in _registry:
+            _registry[("preprocessor", backend)] = SharedSentencePreprocessor(
+                tokenizer=get_tokenizer(),
+                embedding_model=get_embedding_model(backend),
+                senticnet=artifacts.senticnet(),
+                device="cpu",
+            )
+        return _registry[("preprocessor", backend)]
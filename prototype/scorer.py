@@ -0,0 +1,120 @@
+from collections import namedtuple
+
+from prototype.aspects import AspectMatcher
+
+# rating and bias_rating run from 1 to 5 and are None when the review mentions no
+# aspect, in which case the manual rating is kept. confidence and
+# bias_confidence are the mean probability each head gave its labels. aspects
+# holds a (head, aspect, label, confidence) tuple per aspect occurrence and head,
+# head being "sentiment" or "bias".
+ReviewScore = namedtuple(
+    "ReviewScore",
+    [
+        "rating",
+        "flag",
+        "bias_rating",
+        "bias_flag",
+        "confidence",
+        "bias_confidence",
+        "aspects",
+    ],
+)
+
+MANUAL = ReviewScore(None, "Manual", None, "Unbiased", None, None, [])
+
+
+def collapse(aspect_scores):
+    """Turns labels of -1, 0 or 1 into a rating of 1 to 5 and a mean confidence"""
+    rating = sum((2 * aspect.label) + 3 for aspect in aspect_scores) // len(
+        aspect_scores
+    )
+    confidence = sum(aspect.confidence for aspect in aspect_scores) / len(aspect_scores)
+    return rating, confidence
+
+
+class ReviewScorer:
+    """Scores reviews with the sentiment and bias heads in a single pass
+
+    Aspects are detected once with the union of both heads' vocabularies, and
+    both GCN heads run over the same preprocessed tensors, so a review costs one
+    tokenization and one BERT pass however many heads score it. Each head then
+    only keeps the aspects of its own vocabulary, so an aspects.txt of either
+    model still applies.
+    """
+
+    def __init__(self, predictor=None, bias_predictor=None):
+        """
+        Args:
+            predictor (SentimentHead, optional): Sentiment head. Defaults to
+            ReviewSentiment.
+            bias_predictor (SentimentHead, optional): Bias head sharing the
+            predictor's preprocessor. Defaults to BiasSentiment.
+        """
+        if predictor is None:
+            from prototype.model import ReviewSentiment
+
+            predictor = ReviewSentiment()
+        if bias_predictor is None:
+            from bias_prototype.model import BiasSentiment
+
+            bias_predictor = BiasSentiment()
+        self.predictor = predictor
+        self.bias_predictor = bias_predictor
+        self.matcher = AspectMatcher(predictor.aspects + bias_predictor.aspects)
+        self.version = f"{predictor.version}|{bias_predictor.version}"
+
+    def find(self, review):
+        """Detects the aspect occurrences of a review in either vocabulary, see
+        SentimentHead.find
+        """
+        return self.matcher.find(review.lower().strip())
+
+    def score(self, reviews, matches=None):
+        """Scores review texts
+        Args:
+            reviews (list): Review texts
+            matches (list, optional): Output of find per review, when aspects
+            were already detected
+        Returns:
+            arr: ReviewScore per review
+        """
+        if matches is None:
+            matches = [self.find(review) for review in reviews]
+        processed = self.predictor.preprocess_batch(reviews, matches)
+        predictions = self.predictor.score_aspects_processed(processed, len(reviews))
+        bias_predictions = self.bias_predictor.score_aspects_processed(
+            processed, len(reviews)
+        )
+        vocabulary = set(self.predictor.matcher.aspects)
+        bias_vocabulary = set(self.bias_predictor.matcher.aspects)
+        scores = []
+        for prediction, bias_prediction in zip(predictions, bias_predictions):
+            prediction = [a for a in prediction if a.aspect in vocabulary]
+            bias_prediction = [
+                a for a in bias_prediction if a.aspect in bias_vocabulary
+            ]
+            if not prediction and not bias_prediction:
+                scores.append(MANUAL)
+                continue
+            # A head that found none of its aspects leaves its fields as in MANUAL
+            rating, flag, confidence = MANUAL.rating, MANUAL.flag, None
+            if prediction:
+                rating, confidence = collapse(prediction)
+                flag = "AI"
+            bias_rating, bias_flag, bias_confidence = None, MANUAL.bias_flag, None
+            if bias_prediction:
+                bias_rating, bias_confidence = collapse(bias_prediction)
+                bias_flag = "Biased" if bias_rating >= 2.5 else "Unbiased"
+            scores.append(
+                ReviewScore(
+                    rating,
+                    flag,
+                    bias_rating,
+                    bias_flag,
+                    confidence,
+                    bias_confidence,
+                    [("sentiment", *aspect) for aspect in prediction]
+                    + [("bias", *aspect) for aspect in bias_prediction],
+                )
+            )
+        return scores
@@ -0,0 +1,282 @@
+"""Bulk review import and rescoring
+
+Imports reviews from a CSV or JSONL file with teacher_id, user_id, review and
+optionally rating and reliable_flag columns, or from a .raw dataset in the
+format of prototype/dataset. Reviews are scored in batches through both
+predictors and inserted with executemany, one transaction per commit batch.
+Each transaction also records how far the job got in bulk_checkpoints, so an
+interrupted run picks up where it stopped. A batch the models fail on is scored
+again one review at a time, and a review that still fails keeps its manual
+rating:
+
+    python -m utils.bulk import reviews.csv --db test.db
+    python -m utils.bulk rescore --db test.db --workers 4
+
+rescore replaces the scores of every existing review in place, for when the
+models change. Its checkpoint is cleared once it finishes. Pass --restart to
+start an interrupted job over.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import traceback
+
+from prototype.scorer import MANUAL
+from utils.datastore import Datastore
+
+# Manual rating given to .raw samples, by polarity
+POLARITY_RATING = {-1: 1, 0: 3, 1: 5}
+
+_scorer = None
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        yield from csv.DictReader(f)
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_raw_reviews(path):
+    """Reads the sentences of a .raw dataset as reviews. A sentence with several
+    aspects spans consecutive samples and is read once, rated with the mean
+    rating of its aspects' polarities.
+    Yields:
+        dict: review and rating
+    """
+    from prototype.dataset import read_raw
+
+    samples = itertools.groupby(read_raw(path), key=lambda sample: sample[0])
+    for sentence, group in samples:
+        ratings = [POLARITY_RATING[polarity] for _, _, polarity in group]
+        yield {"review": sentence, "rating": sum(ratings) // len(ratings)}
+
+
+def read_reviews(path, teacher_id=None, user_id=None):
+    """Streams reviews to import from a file
+    Args:
+        path (str): .csv, .jsonl or .raw file
+        teacher_id (int, optional): Teacher of rows that name none, required for
+        .raw files
+        user_id (int, optional): Author of rows that name none, required for
+        .raw files
+    Yields:
+        dict: teacher_id, user_id, review, rating and reliable_flag
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == ".raw":
+        rows = read_raw_reviews(path)
+    elif extension == ".csv":
+        rows = read_csv(path)
+    elif extension in (".jsonl", ".json"):
+        rows = read_jsonl(path)
+    else:
+        raise ValueError(f"Cannot import {path}, expected .csv, .jsonl or .raw")
+
+    for row in rows:
+        review = {
+            "teacher_id": row.get("teacher_id") or teacher_id,
+            "user_id": row.get("user_id") or user_id,
+            "review": row["review"],
+            "rating": int(row.get("rating") or 3),
+            "reliable_flag": row.get("reliable_flag") or "Verified",
+        }
+        if review["teacher_id"] is None or review["user_id"] is None:
+            raise ValueError(
+                "Every review needs a teacher_id and user_id, pass --teacher-id "
+                "and --user-id for files without them"
+            )
+        yield review
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _start_worker(threads):
+    global _scorer
+    from utils.inference_executor import configure_threads
+    from utils.inference_server import LocalScorer
+
+    configure_threads(threads)
+    _scorer = LocalScorer()
+
+
+def score_rows(score, batch):
+    """Scores a batch, falling back to one review at a time if it fails
+    Args:
+        score (function): Scores a list of review texts
+        batch (list): Dicts with a review key
+    Returns:
+        arr: Scores of the batch, None for reviews the models failed on
+    """
+    reviews = [row["review"] for row in batch]
+    try:
+        return score(reviews)
+    except Exception:
+        traceback.print_exc()
+    if len(reviews) == 1:
+        return [None]
+    # One review the models cannot take fails the whole batch, so only that
+    # review is left unscored
+    scores = []
+    for review in reviews:
+        try:
+            scores.extend(score([review]))
+        except Exception:
+            traceback.print_exc()
+            scores.append(None)
+    return scores
+
+
+def _score_batch(batch):
+    return batch, score_rows(_scorer.score, batch)
+
+
+def score_batches(db, batches, workers=1):
+    """Scores batches of reviews, in order
+    Args:
+        db (Datastore): Scores in-process or through the model server when
+        workers is 1
+        batches (iterable): Lists of dicts with a review key
+        workers (int, optional): Processes each loading their own models.
+        Defaults to 1.
+    Yields:
+        tup: (batch, scores), see score_rows
+    """
+    if workers <= 1:
+        for batch in batches:
+            yield batch, score_rows(db.score_reviews, batch)
+        return
+    # spawn, since forking a process that may hold torch state is unsafe
+    context = multiprocessing.get_context("spawn")
+    # Workers split the cores instead of each sizing torch for the whole host
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with context.Pool(workers, initializer=_start_worker, initargs=(threads,)) as pool:
+        # Only a few batches per worker are in flight, so the input is never
+        # read into memory as a whole
+        for window in chunks(batches, workers * 2):
+            yield from pool.imap(_score_batch, window)
+
+
+def import_reviews(
+    db, path, teacher_id=None, user_id=None, batch_size=32, commit_size=1024, workers=1
+):
+    """Scores and inserts every review of a file, resuming from its checkpoint
+    Returns:
+        int: Reviews imported by this run
+    """
+    name = f"import:{os.path.abspath(path)}"
+    position = db.get_checkpoint(name)
+    reviews = itertools.islice(read_reviews(path, teacher_id, user_id), position, None)
+    imported = 0
+    scored = score_batches(db, chunks(reviews, batch_size), workers)
+    for commit in chunks(scored, max(commit_size // batch_size, 1)):
+        rows = [row for batch, _ in commit for row in batch]
+        # Reviews the models failed on keep their manual rating, so that a
+        # resumed import does not stop at them again
+        scores = [
+            MANUAL if score is None else score
+            for _, batch_scores in commit
+            for score in batch_scores
+        ]
+        position += len(rows)
+        db.import_reviews(rows, scores, checkpoint=(name, position))
+        imported += len(rows)
+        print(f"Imported {position} reviews")
+    return imported
+
+
+def iter_scored_reviews(db, after, size):
+    """Streams reviews that are not pending, in id order, a page at a time"""
+    while True:
+        page = db.get_records("get_reviews_after", (after, size))
+        if not page:
+            return
+        yield from page
+        after = page[-1]["review_id"]
+
+
+def rescore_reviews(db, batch_size=32, commit_size=1024, workers=1):
+    """Scores every review again, resuming from the last committed id
+    Returns:
+        int: Reviews rescored by this run
+    """
+    name = "rescore"
+    reviews = iter_scored_reviews(db, db.get_checkpoint(name), commit_size)
+    rescored = 0
+    scored = score_batches(db, chunks(reviews, batch_size), workers)
+    for commit in chunks(scored, max(commit_size // batch_size, 1)):
+        scored_rows = [
+            (row, score)
+            for batch, batch_scores in commit
+            for row, score in zip(batch, batch_scores)
+        ]
+        last = scored_rows[-1][0]["review_id"]
+        # Reviews the models failed on keep their current scores
+        rows, scores = [], []
+        for row, score in scored_rows:
+            if score is not None:
+                rows.append(row)
+                scores.append(score)
+        db.rescore_reviews(rows, scores, checkpoint=(name, last))
+        rescored += len(rows)
+        print(f"Rescored reviews up to id {last}")
+    # Finished, the next model change rescores from the start
+    db.reset_checkpoint(name)
+    return rescored
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import and rescore reviews")
+    parser.add_argument("command", choices=["import", "rescore"])
+    parser.add_argument("path", nargs="?", help=".csv, .jsonl or .raw file to import")
+    parser.add_argument("--db", default="test.db", help="path to the database")
+    parser.add_argument("--teacher-id", type=int, help="teacher of rows without one")
+    parser.add_argument("--user-id", type=int, help="author of rows without one")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--commit-size", type=int, default=1024)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the job's checkpoint"
+    )
+    args = parser.parse_args()
+    if args.command == "import" and args.path is None:
+        parser.error("import needs a path")
+
+    db = Datastore(args.db)
+    db.tables_init()
+    started = time.perf_counter()
+    if args.command == "import":
+        if args.restart:
+            db.reset_checkpoint(f"import:{os.path.abspath(args.path)}")
+        count = import_reviews(
+            db,
+            args.path,
+            args.teacher_id,
+            args.user_id,
+            args.batch_size,
+            args.commit_size,
+            args.workers,
+        )
+    else:
+        if args.restart:
+            db.reset_checkpoint("rescore")
+        count = rescore_reviews(db, args.batch_size, args.commit_size, args.workers)
+    verb = "Imported" if args.command == "import" else "Rescored"
+    print(f"{verb} {count} reviews in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,83 @@
+import os
+import tempfile
+
+# SQLite database of the web app
+DATABASE = os.environ.get("RAPPORTCARD_DB", "test.db")
+
+# Unix socket of the shared model server (python -m utils.inference_server). Its
+# directory must be writable by nobody but the user running the app, so it
+# defaults to the per-user runtime directory rather than /tmp itself.
+INFERENCE_SOCKET = os.environ.get(
+    "RAPPORTCARD_INFERENCE_SOCKET",
+    os.path.join(
+        os.environ.get("XDG_RUNTIME_DIR")
+        or os.path.join(tempfile.gettempdir(), f"rapportcard-{os.getuid()}"),
+        "rapportcard-inference.sock",
+    ),
+)
+
+# Load the models when a worker starts instead of on the first review
+WARM_UP = os.environ.get("RAPPORTCARD_WARM_UP", "1") == "1"
+
+# Local copies of bert-base-uncased and the senticnet lexicon, see
+# python -m prototype.artifacts
+ARTIFACT_DIR = os.environ.get("RAPPORTCARD_ARTIFACT_DIR", "./artifacts")
+
+# Never touch the network; missing or corrupt artifacts are an error
+OFFLINE = os.environ.get("RAPPORTCARD_OFFLINE", "0") == "1"
+
+# SQLite file shared by every process for cached review scores. Empty keeps the
+# cache in memory only.
+PREDICTION_CACHE = os.environ.get("RAPPORTCARD_PREDICTION_CACHE", "prediction_cache.db")
+PREDICTION_CACHE_SIZE = int(os.environ.get("RAPPORTCARD_PREDICTION_CACHE_SIZE", "4096"))
+# Days a cached score is kept on disk. 0 keeps scores forever.
+PREDICTION_CACHE_DAYS = float(os.environ.get("RAPPORTCARD_PREDICTION_CACHE_DAYS", "30"))
+
+# eager, quantized or onnx, see prototype.backends
+INFERENCE_BACKEND = os.environ.get("RAPPORTCARD_BACKEND", "eager")
+
+# Users, teachers, aggregates and first review pages cached per process
+RECORD_CACHE_SIZE = int(os.environ.get("RAPPORTCARD_RECORD_CACHE_SIZE", "2048"))
+# Seconds a cached record may be served for; bounds how stale another process'
+# writes can look. 0 disables the cache.
+RECORD_CACHE_TTL = float(os.environ.get("RAPPORTCARD_RECORD_CACHE_TTL", "30"))
+
+# Requests taking at least this many seconds are logged to rapportcard.slow.
+# 0 turns the log off.
+SLOW_REQUEST_SECONDS = float(os.environ.get("RAPPORTCARD_SLOW_REQUEST_SECONDS", "0"))
+
+# Reviews waiting to be scored before new ones are turned away with a 503
+SCORING_BACKLOG_LIMIT = int(os.environ.get("RAPPORTCARD_SCORING_BACKLOG_LIMIT", "200"))
+
+# gunicorn workers and threads per worker, see gunicorn_config.py. Without the
+# model server every worker loads its own copy of the models, so capacity comes
+# from threads: requests never run inference and mostly wait on SQLite.
+WEB_WORKER_CLASS = os.environ.get("RAPPORTCARD_WORKER_CLASS", "gthread")
+WEB_WORKERS = int(os.environ.get("RAPPORTCARD_WEB_WORKERS", "2"))
+WEB_THREADS = int(
+    os.environ.get(
+        "RAPPORTCARD_WEB_THREADS", max(4, 2 * (os.cpu_count() or 1) // WEB_WORKERS)
+    )
+)
+
+# Batches scored at once per process, see utils.inference_executor. Every batch
+# runs on TORCH_THREADS intra-op threads, so keep
+# INFERENCE_CONCURRENCY * TORCH_THREADS at or below the cores the process may use.
+# python -m benchmarks.inference --tune finds the fastest combination.
+INFERENCE_CONCURRENCY = int(os.environ.get("RAPPORTCARD_INFERENCE_CONCURRENCY", "1"))
+# torch's defaults use every core in every process, which oversubscribes the host
+# once several web workers score at once
+TORCH_THREADS = int(
+    os.environ.get(
+        "RAPPORTCARD_TORCH_THREADS",
+        max(1, (os.cpu_count() or 1) // (WEB_WORKERS * INFERENCE_CONCURRENCY)),
+    )
+)
+TORCH_INTEROP_THREADS = int(os.environ.get("RAPPORTCARD_TORCH_INTEROP_THREADS", "1"))
+
+# Signs the session cookie. Set it in production; anyone who knows it can log in
+# as any user.
+SECRET_KEY = os.environ.get("RAPPORTCARD_SECRET_KEY", "IDGAF")
+# Seconds the user stored in a session is trusted before it is read from the
+# database again, see utils.user.User.from_session
+SESSION_USER_TTL = float(os.environ.get("RAPPORTCARD_SESSION_USER_TTL", "300"))
@@ -1,45 +1,17 @@
+import argparse
+import os
+import re
 import sqlite3
-from prototype.model import ReviewSentiment
-from bias_prototype.model import BiasSentiment
-
-init_table = {
-    "teachers": """
-        CREATE TABLE IF NOT EXISTS teachers (
-            id INTEGER PRIMARY KEY,
-            name TEXT,
-            school_id INTEGER,
-            FOREIGN KEY(school_id) REFERENCES schools(id)
-        );
-    """,
-    "users": """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT,
-            password TEXT
-        );
-    """,
-    "reviews": """
-        CREATE TABLE IF NOT EXISTS reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            teacher_id INTEGER,
-            user_id INTEGER,
-            rating INTEGER,
-            comment TEXT,
-            flag TEXT,
-            bias_rating INTEGER,
-            bias_flag TEXT,
-            reliable_flag TEXT,
-            FOREIGN KEY(teacher_id) REFERENCES teachers(id),
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        );
-    """,
-    "schools": """
-        CREATE TABLE IF NOT EXISTS schools (
-            id INTEGER PRIMARY KEY,
-            name TEXT
-        );
-    """,
-}
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from utils import config, metrics
+from utils.inference_server import InferenceClient
+from utils.migrations import REBUILD_TEACHER_STATS, migrate
+from utils.pool import ConnectionPool
+from utils.record_cache import RecordCache
 
 insert_table = {
     "create_teacher": """
@@ -54,6 +26,19 @@ insert_table = {
     "create_school": """
     INSERT INTO schools VALUES (id, name);
     """,
+    "enqueue_scoring": """
+    INSERT INTO scoring_jobs (review_id) VALUES (?);
+    """,
+    "create_teacher_stats": """
+    INSERT OR IGNORE INTO teacher_stats (teacher_id) VALUES (?);
+    """,
+    "rebuild_teacher_stats": REBUILD_TEACHER_STATS,
+    "add_review_aspect": """
+    INSERT INTO review_aspects (review_id, teacher_id, head, aspect, label, confidence) VALUES (?, ?, ?, ?, ?, ?);
+    """,
+    "set_checkpoint": """
+    INSERT OR REPLACE INTO bulk_checkpoints (name, position) VALUES (?, ?);
+    """,
 }
 
 query_table = {
@@ -65,9 +50,31 @@ query_table = {
     """,
     "search_teacher": """
     SELECT teachers.id AS teacher_id, teachers.name AS teacher_name, schools.name AS school_name
+    FROM teacher_fts
+    JOIN teachers ON teachers.id = teacher_fts.rowid
+    JOIN schools ON teachers.school_id = schools.id
+    WHERE teacher_fts MATCH ?
+    ORDER BY bm25(teacher_fts, 10.0, 1.0), teachers.id
+    LIMIT ? OFFSET ?;
+    """,
+    "search_teacher_fuzzy": """
+    SELECT teachers.id AS teacher_id, teachers.name AS teacher_name, schools.name AS school_name
+    FROM teacher_trigram
+    JOIN teachers ON teachers.id = teacher_trigram.rowid
+    JOIN schools ON teachers.school_id = schools.id
+    WHERE teacher_trigram MATCH ?
+    ORDER BY bm25(teacher_trigram, 10.0, 1.0), teachers.id
+    LIMIT ? OFFSET ?;
+    """,
+    "has_search_match": """
+    SELECT 1 AS found FROM teacher_fts WHERE teacher_fts MATCH ? LIMIT 1;
+    """,
+    "list_teachers": """
+    SELECT teachers.id AS teacher_id, teachers.name AS teacher_name, schools.name AS school_name
     FROM teachers
     JOIN schools ON teachers.school_id = schools.id
-    WHERE teachers.name LIKE ?;
+    ORDER BY teachers.name, teachers.id
+    LIMIT ? OFFSET ?;
     """,
     "get_teacher_by_id": """
     SELECT teachers.name AS teacher_name, schools.name AS school_name
@@ -75,52 +82,288 @@ query_table = {
     JOIN schools ON teachers.school_id = schools.id
     WHERE teachers.id = ?;
     """,
-    "get_review": """
-    SELECT users.username AS username, reviews.rating AS rating, reviews.comment AS review, reviews.flag AS flag, reviews.bias_rating AS bias_rating, reviews.bias_flag as bias_flag, reviews.reliable_flag AS reliable_flag
+    "get_review_page": """
+    SELECT reviews.id AS review_id, users.username AS username, reviews.rating AS rating, reviews.comment AS review, reviews.flag AS flag, reviews.bias_rating AS bias_rating, reviews.bias_flag as bias_flag, reviews.reliable_flag AS reliable_flag
     FROM reviews
     JOIN users ON users.id = reviews.user_id
-    WHERE reviews.teacher_id = ?
-    ORDER BY reviews.id DESC;
+    WHERE reviews.teacher_id = ? AND reviews.id < ?
+    ORDER BY reviews.id DESC
+    LIMIT ?;
+    """,
+    "get_reviews_after": """
+    SELECT id AS review_id, comment AS review
+    FROM reviews
+    WHERE id > ? AND flag IS NOT 'Pending'
+    ORDER BY id
+    LIMIT ?;
+    """,
+    "get_aspect_summary": """
+    SELECT aspect, count(*) AS mentions, avg(label) AS sentiment, sum(label = 1) AS positive, sum(label = 0) AS neutral, sum(label = -1) AS negative, avg(confidence) AS confidence
+    FROM review_aspects
+    WHERE teacher_id = ? AND head = ?
+    GROUP BY aspect
+    ORDER BY mentions DESC, aspect;
+    """,
+    "get_review_aspects": """
+    SELECT head, aspect, label, confidence
+    FROM review_aspects
+    WHERE review_id = ?
+    ORDER BY id;
+    """,
+    "get_checkpoint": """
+    SELECT position FROM bulk_checkpoints WHERE name = ?;
     """,
     "get_aggregated_score": """
-    SELECT avg(reviews.rating) AS rating
+    SELECT CAST(rating_sum AS REAL) / review_count AS rating
+    FROM teacher_stats
+    WHERE teacher_id = ? AND review_count > 0;
+    """,
+    "get_teacher_stats": """
+    SELECT * FROM teacher_stats WHERE teacher_id = ?;
+    """,
+    "get_review_state": """
+    SELECT teacher_id, rating, flag, bias_flag, reliable_flag
     FROM reviews
-    WHERE reviews.teacher_id = ?
+    WHERE id = ?;
     """,
     "get_review_by_id": """
-    SELECT reviews.rating AS rating, reviews.bias_rating AS bias_rating, reviews.bias_flag AS bias_flag, reviews.reliable_flag AS reliable_flag
+    SELECT reviews.rating AS rating, reviews.flag AS flag, reviews.bias_rating AS bias_rating, reviews.bias_flag AS bias_flag, reviews.reliable_flag AS reliable_flag
     FROM reviews
     WHERE reviews.id = ?;
     """,
+    "get_claimable_jobs": """
+    SELECT scoring_jobs.id AS job_id, scoring_jobs.review_id AS review_id, scoring_jobs.attempts AS attempts, reviews.comment AS review
+    FROM scoring_jobs
+    JOIN reviews ON reviews.id = scoring_jobs.review_id
+    WHERE scoring_jobs.status = 'queued'
+    OR (scoring_jobs.status = 'running' AND scoring_jobs.claimed_at < ?)
+    ORDER BY scoring_jobs.id
+    LIMIT ?;
+    """,
+    "has_claimable_jobs": """
+    SELECT 1 AS found FROM scoring_jobs
+    WHERE status = 'queued' OR (status = 'running' AND claimed_at < ?)
+    LIMIT 1;
+    """,
+    "count_queued_jobs": """
+    SELECT count(*) AS count FROM scoring_jobs WHERE status = 'queued';
+    """,
 }
 
 
+def dict_factory(cursor: sqlite3.Cursor, row: sqlite3.Row) -> dict:
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+# Larger than any review id, the key of the first page
+FIRST_PAGE = 2**63 - 1
+
+# Reviews per page. First pages of this size are cached.
+REVIEW_PAGE_SIZE = 20
+
+
+class RecordPage:
+    """Streams one keyset-paginated page of rows
+
+    Wraps a row iterator holding up to limit + 1 rows. Iterating yields at most
+    limit rows; afterwards next_key holds the key of the following page, or None
+    if this was the last one.
+    """
+
+    def __init__(self, rows, limit, key):
+        """
+        Args:
+            rows (iterator): Rows of the page plus one extra if there are more
+            limit (int): Rows in a page
+            key (str): Column to paginate on
+        """
+        self.rows = rows
+        self.limit = limit
+        self.key = key
+        self.next_key = None
+
+    def __iter__(self):
+        last = None
+        for count, row in enumerate(self.rows):
+            if count == self.limit:
+                self.next_key = last[self.key]
+                break
+            last = row
+            yield row
+        # Releases the cursor of a streamed page early
+        close = getattr(self.rows, "close", None)
+        if close is not None:
+            close()
+
+
+# Queries that cannot use an index by design
+FULL_SCAN_ALLOWED = {"list_teachers"}
+
+
 class Datastore:
-    def __init__(self, uri: str):
+    def __init__(self, uri: str, scorer=None, pool_size=8, cache=None):
         """Initialize a database with given URI
 
         Args:
             uri (string): URI for database
+            scorer (InferenceClient, optional): Scorer for queued reviews.
+            Defaults to a client of the shared model server.
+            pool_size (int, optional): Idle connections kept. Defaults to 8.
+            cache (RecordCache, optional): Cache of hot records. Defaults to one
+            sized by config.RECORD_CACHE_SIZE and config.RECORD_CACHE_TTL.
         """
         self.uri = uri
-        self.predictor = ReviewSentiment()
-        self.bias_predictor = BiasSentiment()
+        self.scorer = scorer if scorer is not None else InferenceClient()
+        self.pool = ConnectionPool(uri, size=pool_size, row_factory=dict_factory)
+        if cache is None:
+            cache = RecordCache(config.RECORD_CACHE_SIZE, config.RECORD_CACHE_TTL)
+        self.cache = cache
+        self._local = threading.local()
+
+    def init_app(self, app):
+        """Returns connections to the pool when a Flask app context ends"""
+        app.teardown_appcontext(self.release_conn)
 
     def get_conn(self) -> sqlite3.Connection:
-        """Retrieves a connection with the database
+        """Retrieves the connection of the current thread, taking one from the
+        pool if it has none. It is kept until release_conn is called.
         Returns:
             conn: A sqlite3 Connection object connected to stored URI
         """
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = self.pool.acquire()
+            self._local.pid = os.getpid()
+        return conn
+
+    def release_conn(self, exception=None):
+        """Returns the connection of the current thread to the pool"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            self._local.conn = None
+            if self._local.pid == os.getpid():
+                self.pool.release(conn)
+
+    def close(self):
+        self.release_conn()
+        self.pool.close()
+
+    @contextmanager
+    def transaction(self):
+        """Runs a block in a write transaction, committed if the block succeeds
+        Yields:
+            cur: A cursor of the current thread's connection
+        """
+        conn = self.get_conn()
+        # IMMEDIATE takes the write lock up front, so rows read inside the block
+        # cannot change before they are written
+        with metrics.write_lock_seconds.time():
+            conn.execute("BEGIN IMMEDIATE")
+        # Teachers whose reviews change, collected by _count_review
+        self._local.touched = set()
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        self.invalidate_teachers(self._local.touched)
 
-        def dict_factory(cursor: sqlite3.Cursor, row: sqlite3.Row) -> dict:
-            d = {}
-            for idx, col in enumerate(cursor.description):
-                d[col[0]] = row[idx]
-            return d
+    def invalidate_teachers(self, teacher_ids):
+        """Drops the cached aggregates and first review page of teachers"""
+        for teacher_id in teacher_ids:
+            self.cache.invalidate(
+                ("aggregate", teacher_id),
+                ("teacher_stats", teacher_id),
+                ("reviews", teacher_id),
+                ("aspects", teacher_id, "sentiment"),
+                ("aspects", teacher_id, "bias"),
+            )
 
-        conn = sqlite3.connect(self.uri)
-        conn.row_factory = dict_factory
-        return conn
+    def _count_review(self, cur, review, sign):
+        """Adds (sign=1) or removes (sign=-1) a review from its teacher's stats
+        Args:
+            cur (sqlite3.Cursor): Cursor inside the transaction changing the review
+            review (dict): teacher_id, rating, flag, bias_flag and reliable_flag
+            sign (int): 1 or -1
+        """
+        self._local.touched.add(int(review["teacher_id"]))
+        cur.execute(insert_table["create_teacher_stats"], (review["teacher_id"],))
+        if review["flag"] == "Pending":
+            cur.execute(
+                "UPDATE teacher_stats SET pending_count = pending_count + ? WHERE teacher_id = ?",
+                (sign, review["teacher_id"]),
+            )
+            return
+        rating = int(review["rating"])
+        cur.execute(
+            """UPDATE teacher_stats SET
+            review_count = review_count + ?,
+            rating_sum = rating_sum + ?,
+            biased_count = biased_count + ?,
+            unverified_count = unverified_count + ?,
+            rating_1 = rating_1 + ?,
+            rating_2 = rating_2 + ?,
+            rating_3 = rating_3 + ?,
+            rating_4 = rating_4 + ?,
+            rating_5 = rating_5 + ?
+            WHERE teacher_id = ?""",
+            (
+                sign,
+                sign * rating,
+                sign * (review["bias_flag"] == "Biased"),
+                sign * (review["reliable_flag"] == "Unverified"),
+                *(sign * (rating == bucket) for bucket in range(1, 6)),
+                review["teacher_id"],
+            ),
+        )
+
+    def _change_review(self, cur, review_id, **changes):
+        """Updates columns of a review and moves it between stats buckets
+        Returns:
+            dict: The review before the change, or None if it does not exist
+        """
+        cur.execute(query_table["get_review_state"], (int(review_id),))
+        old = cur.fetchone()
+        if old is None:
+            return None
+        new = dict(old, **changes)
+        if new["rating"] is None:
+            new["rating"] = old["rating"]
+        self._count_review(cur, old, -1)
+        self._count_review(cur, new, 1)
+        assignments = ", ".join(f"{column} = ?" for column in changes)
+        cur.execute(
+            f"UPDATE reviews SET {assignments} WHERE id = ?",
+            (*(new[column] for column in changes), int(review_id)),
+        )
+        return old
+
+    def _store_aspects(self, cur, review_id, teacher_id, aspects):
+        """Replaces the per-aspect scores of a review
+        Args:
+            cur (sqlite3.Cursor): Cursor inside the transaction scoring the review
+            review_id (int): Scored review
+            teacher_id (int): Teacher of the review
+            aspects (list): (head, aspect, label, confidence) tuples, see
+            ReviewScore
+        """
+        cur.execute("DELETE FROM review_aspects WHERE review_id = ?", (review_id,))
+        cur.executemany(
+            insert_table["add_review_aspect"],
+            [(review_id, teacher_id, *aspect) for aspect in aspects],
+        )
+
+    def rebuild_teacher_stats(self):
+        """Recomputes every teacher's stats from the reviews table"""
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM teacher_stats")
+            cur.execute(insert_table["rebuild_teacher_stats"])
+        self.cache.invalidate_kind("aggregate")
+        self.cache.invalidate_kind("teacher_stats")
 
     def get_record(self, command, param=None):
         """Retrieve a single record using key from query_table
@@ -133,11 +376,12 @@ class Datastore:
         """
         conn = self.get_conn()
         cur = conn.cursor()
-        if param is None:
-            cur.execute(query_table[command])
-        else:
-            cur.execute(query_table[command], param)
-        return cur.fetchone()
+        with metrics.time_query(command):
+            if param is None:
+                cur.execute(query_table[command])
+            else:
+                cur.execute(query_table[command], param)
+            return cur.fetchone()
 
     def get_records(self, command, param=None):
         """Retrieve records using key from query_table
@@ -150,61 +394,187 @@ class Datastore:
         """
         conn = self.get_conn()
         cur = conn.cursor()
-        if param is None:
-            cur.execute(query_table[command])
-        else:
-            cur.execute(query_table[command], param)
-        return cur.fetchall()
+        with metrics.time_query(command):
+            if param is None:
+                cur.execute(query_table[command])
+            else:
+                cur.execute(query_table[command], param)
+            return cur.fetchall()
+
+    def iter_records(self, command, param=None, size=64):
+        """Streams records using key from query_table without loading them all
+        Args:
+            command (str): A key in query_table
+            param (tup/list, optional): parameters to pass in.
+            Defaults to None.
+            size (int, optional): Rows fetched at a time. Defaults to 64.
+        Yields:
+            dict: One row at a time
+        """
+        cur = self.get_conn().cursor()
+        # Only time spent in SQLite counts, not the consumer's work in between
+        elapsed = 0.0
+        try:
+            started = time.perf_counter()
+            if param is None:
+                cur.execute(query_table[command])
+            else:
+                cur.execute(query_table[command], param)
+            while True:
+                rows = cur.fetchmany(size)
+                elapsed += time.perf_counter() - started
+                if not rows:
+                    return
+                yield from rows
+                started = time.perf_counter()
+        finally:
+            cur.close()
+            metrics.record_query(command, elapsed)
 
     def tables_init(self):
-        """Initializes required tables for the database"""
-        conn = self.get_conn()
-        cursor = conn.cursor()
-        for table_commands in init_table.keys():
-            cursor.execute(init_table[table_commands])
+        """Creates or migrates the tables to the latest schema version
+        Returns:
+            arr: Migration versions applied
+        """
+        applied = migrate(self.get_conn())
+        self.release_conn()
+        return applied
 
-        conn.commit()
-        conn.close()
+    def explain(self, command, param=None):
+        """Retrieves the query plan of a query in query_table
+        Args:
+            command (str): A key in query_table
+            param (tup/list, optional): parameters to pass in. Defaults to a
+            placeholder value per parameter.
+        Returns:
+            arr: The detail column of every EXPLAIN QUERY PLAN row
+        """
+        if param is None:
+            param = ("x",) * query_table[command].count("?")
+        cur = self.get_conn().execute(
+            f"EXPLAIN QUERY PLAN {query_table[command]}", param
+        )
+        return [row["detail"] for row in cur.fetchall()]
+
+    def check_query_plans(self):
+        """Finds queries in query_table that scan a whole table
+        Returns:
+            dict: Offending plan steps per query
+        """
+        offending = {}
+        for command in query_table:
+            if command in FULL_SCAN_ALLOWED:
+                continue
+            # Full-text MATCH shows up as a scan of the virtual table's index
+            scans = [
+                detail
+                for detail in self.explain(command)
+                if detail.startswith("SCAN") and "VIRTUAL TABLE" not in detail
+            ]
+            if scans:
+                offending[command] = scans
+        return offending
 
     def get_user_by_id(self, user_id):
-        user = self.get_record("load_user_by_id", (user_id,))
+        # A user created by another process must not stay missing here
+        user = self.cache.get(
+            ("user", int(user_id)),
+            lambda: self.get_record("load_user_by_id", (user_id,)),
+            cache_missing=False,
+        )
         return user
 
     def get_user_by_name(self, username):
-        user = self.get_record("load_user_by_name", (username,))
-        return user
+        # Not cached: it backs logins and signups, which must see users created
+        # by any process
+        return self.get_record("load_user_by_name", (username,))
 
     def create_user(self, username, password):
+        """Creates a user
+        Returns:
+            bool: False if the username is already taken
+        """
         conn = self.get_conn()
-        conn.execute(insert_table["create_user"], (username, password))
+        try:
+            conn.execute(insert_table["create_user"], (username, password))
+        except sqlite3.IntegrityError:
+            conn.rollback()
+            return False
         conn.commit()
+        return True
+
+    def search_teacher(self, teacher_name, limit=12, offset=0):
+        """Searches teachers by teacher and school name, best matches first.
+        Words match by prefix; if nothing does, the query is matched fuzzily by
+        the trigrams it shares with names.
+        Args:
+            teacher_name (str): Search text
+            limit (int, optional): Maximum rows returned. Defaults to 12.
+            offset (int, optional): Rows skipped. Defaults to 0.
+        Returns:
+            arr: Array of rows
+        """
+        terms = re.findall(r"\w+", teacher_name.lower())
+        if not terms:
+            return self.get_records("list_teachers", (limit, offset))
 
-    def search_teacher(self, teacher_name):
-        teachers = self.get_records("search_teacher", (f"%{teacher_name}%",))
-        return teachers
+        # Quoting every term keeps FTS5 operators in user input literal
+        prefix_query = " ".join(f'"{term}"*' for term in terms)
+        if self.get_record("has_search_match", (prefix_query,)) is not None:
+            return self.get_records("search_teacher", (prefix_query, limit, offset))
+
+        trigrams = {term[i : i + 3] for term in terms for i in range(len(term) - 2)}
+        if not trigrams:
+            return []
+        fuzzy_query = " OR ".join(f'"{trigram}"' for trigram in sorted(trigrams))
+        return self.get_records("search_teacher_fuzzy", (fuzzy_query, limit, offset))
 
     def get_teacher_by_id(self, teacher_id):
-        teacher = self.get_record("get_teacher_by_id", (int(teacher_id),))
-        score = self.get_record("get_aggregated_score", (int(teacher_id),))
-        if score["rating"] is None:
-            score["rating"] = 0.0
+        teacher_id = int(teacher_id)
+        teacher = self.cache.get(
+            ("teacher", teacher_id),
+            lambda: self.get_record("get_teacher_by_id", (teacher_id,)),
+        )
+        score = self.cache.get(
+            ("aggregate", teacher_id),
+            lambda: self.get_record("get_aggregated_score", (teacher_id,)),
+        )
+        if score is None:
+            score = {"rating": 0.0}
         return dict(teacher, **score)
 
+    def get_teacher_stats(self, teacher_id):
+        """Retrieves review count, rating sum, bias counts and the rating
+        histogram of a teacher
+        """
+        stats = self.cache.get(
+            ("teacher_stats", int(teacher_id)),
+            lambda: self.get_record("get_teacher_stats", (int(teacher_id),)),
+        )
+        if stats is None:
+            stats = dict.fromkeys(
+                [
+                    "review_count",
+                    "rating_sum",
+                    "biased_count",
+                    "unverified_count",
+                    "pending_count",
+                    *(f"rating_{bucket}" for bucket in range(1, 6)),
+                ],
+                0,
+            )
+            stats["teacher_id"] = int(teacher_id)
+        return dict(stats)
+
     def add_review(
         self, teacher_id, user_id, rating, review, fallback_rating, reliable_flag
     ):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        prediction = self.predictor.predict(review)
-        bias_prediction = self.bias_predictor.predict(review)
-        if prediction == []:
-            bias_rating = sum((2 * i) + 3 for i in bias_prediction[0]["labels"]) // len(
-                prediction[0]["labels"]
-            )
-            if bias_rating >= 2.5:
-                bias_flag = "Biased"
-            else:
-                bias_flag = "Unbiased"
+        """Stores a review as Pending and queues it for scoring. The manual
+        fallback rating is kept until a ScoringWorker replaces it.
+        Returns:
+            int: id of the new review
+        """
+        with self.transaction() as cur:
             cur.execute(
                 insert_table["add_review"],
                 (
@@ -212,61 +582,284 @@ class Datastore:
                     user_id,
                     fallback_rating,
                     review,
-                    "Manual",
-                    bias_rating,
-                    bias_flag,
+                    "Pending",
+                    None,
+                    "Pending",
                     reliable_flag,
                 ),
             )
             review_id = cur.lastrowid
-            conn.commit()
-        else:
-            rating = sum((2 * i) + 3 for i in prediction[0]["labels"]) // len(
-                prediction[0]["labels"]
+            cur.execute(insert_table["enqueue_scoring"], (review_id,))
+            self._count_review(
+                cur,
+                {"teacher_id": int(teacher_id), "flag": "Pending"},
+                1,
             )
-            bias_rating = sum((2 * i) + 3 for i in bias_prediction[0]["labels"]) // len(
-                prediction[0]["labels"]
+        return review_id
+
+    def warm_up(self):
+        return self.scorer.warm_up()
+
+    def score_reviews(self, reviews):
+        """Scores review texts, see LocalScorer.score"""
+        return self.scorer.score(reviews)
+
+    def count_queued_jobs(self):
+        return self.get_record("count_queued_jobs")["count"]
+
+    def claim_jobs(self, limit, stale_after):
+        """Atomically claims queued scoring jobs. Jobs claimed by a worker that
+        died more than stale_after seconds ago are claimed again.
+        Args:
+            limit (int): Maximum number of jobs to claim
+            stale_after (float): Seconds after which a running job is reclaimed
+        Returns:
+            arr: Claimed jobs with their review text
+        """
+        now = time.time()
+        # Workers poll every second; an empty queue must not cost the write lock
+        if self.get_record("has_claimable_jobs", (now - stale_after,)) is None:
+            return []
+        # The write lock is taken before reading, so two workers never claim
+        # the same job
+        with self.transaction() as cur:
+            cur.execute(query_table["get_claimable_jobs"], (now - stale_after, limit))
+            jobs = cur.fetchall()
+            cur.executemany(
+                "UPDATE scoring_jobs SET status = 'running', claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(now, job["job_id"]) for job in jobs],
             )
-            if bias_rating >= 2.5:
-                bias_flag = "Biased"
-            else:
-                bias_flag = "Unbiased"
-            cur.execute(
+        return jobs
+
+    def complete_jobs(self, jobs, scores):
+        """Writes scores back to the reviews and removes their jobs
+        Args:
+            jobs (list): Jobs returned by claim_jobs
+            scores (list): Output of score_reviews for the jobs, in order
+        """
+        with self.transaction() as cur:
+            for job, score in zip(jobs, scores):
+                review = self._change_review(
+                    cur,
+                    job["review_id"],
+                    rating=score.rating,
+                    flag=score.flag,
+                    bias_rating=score.bias_rating,
+                    bias_flag=score.bias_flag,
+                )
+                if review is not None:
+                    self._store_aspects(
+                        cur, job["review_id"], review["teacher_id"], score.aspects
+                    )
+            cur.executemany(
+                "DELETE FROM scoring_jobs WHERE id = ?",
+                [(job["job_id"],) for job in jobs],
+            )
+
+    def fail_jobs(self, jobs, max_attempts):
+        """Requeues failed jobs. Reviews whose job ran out of attempts keep their
+        manual rating.
+        Args:
+            jobs (list): Jobs returned by claim_jobs
+            max_attempts (int): Attempts after which a job is given up
+        """
+        with self.transaction() as cur:
+            for job in jobs:
+                if job["attempts"] + 1 < max_attempts:
+                    cur.execute(
+                        "UPDATE scoring_jobs SET status = 'queued' WHERE id = ?",
+                        (job["job_id"],),
+                    )
+                else:
+                    cur.execute("SAVEPOINT give_up")
+                    try:
+                        self._change_review(
+                            cur, job["review_id"], flag="Manual", bias_flag="Unbiased"
+                        )
+                    except sqlite3.Error:
+                        raise
+                    except Exception:
+                        # The stored review itself is broken; drop its job anyway
+                        # so that it is not claimed again forever
+                        traceback.print_exc()
+                        cur.execute("ROLLBACK TO give_up")
+                    cur.execute("RELEASE give_up")
+                    cur.execute(
+                        "DELETE FROM scoring_jobs WHERE id = ?", (job["job_id"],)
+                    )
+
+    def get_checkpoint(self, name):
+        """Retrieves how far a bulk job got, 0 if it never committed"""
+        checkpoint = self.get_record("get_checkpoint", (name,))
+        return 0 if checkpoint is None else checkpoint["position"]
+
+    def reset_checkpoint(self, name):
+        with self.transaction() as cur:
+            cur.execute("DELETE FROM bulk_checkpoints WHERE name = ?", (name,))
+
+    def import_reviews(self, reviews, scores, checkpoint=None):
+        """Inserts scored reviews in one transaction
+        Args:
+            reviews (list): Dicts with teacher_id, user_id, review, rating and
+            reliable_flag. rating is kept when no aspect is found.
+            scores (list): Output of score_reviews for the reviews, in order
+            checkpoint (tup, optional): (name, position) committed together with
+            the reviews
+        """
+        rows = []
+        for review, score in zip(reviews, scores):
+            rows.append(
+                {
+                    "teacher_id": int(review["teacher_id"]),
+                    "user_id": int(review["user_id"]),
+                    "rating": (
+                        review["rating"] if score.rating is None else score.rating
+                    ),
+                    "review": review["review"],
+                    "flag": score.flag,
+                    "bias_rating": score.bias_rating,
+                    "bias_flag": score.bias_flag,
+                    "reliable_flag": review["reliable_flag"],
+                    "aspects": score.aspects,
+                }
+            )
+        with self.transaction() as cur:
+            cur.executemany(
                 insert_table["add_review"],
-                (
-                    teacher_id,
-                    user_id,
-                    rating,
-                    review,
-                    "AI",
-                    bias_rating,
-                    bias_flag,
-                    reliable_flag,
+                [
+                    (
+                        row["teacher_id"],
+                        row["user_id"],
+                        row["rating"],
+                        row["review"],
+                        row["flag"],
+                        row["bias_rating"],
+                        row["bias_flag"],
+                        row["reliable_flag"],
+                    )
+                    for row in rows
+                ],
+            )
+            # AUTOINCREMENT ids of rows inserted under one write lock are
+            # consecutive
+            cur.execute("SELECT last_insert_rowid() AS id")
+            first_id = cur.fetchone()["id"] - len(rows) + 1
+            for review_id, row in enumerate(rows, first_id):
+                self._count_review(cur, row, 1)
+                self._store_aspects(cur, review_id, row["teacher_id"], row["aspects"])
+            if checkpoint is not None:
+                cur.execute(insert_table["set_checkpoint"], checkpoint)
+
+    def rescore_reviews(self, reviews, scores, checkpoint=None):
+        """Replaces the scores of existing reviews in one transaction
+        Args:
+            reviews (list): Rows of get_reviews_after
+            scores (list): Output of score_reviews for the reviews, in order
+            checkpoint (tup, optional): (name, position) committed together with
+            the scores
+        """
+        with self.transaction() as cur:
+            for review, score in zip(reviews, scores):
+                old = self._change_review(
+                    cur,
+                    review["review_id"],
+                    rating=score.rating,
+                    flag=score.flag,
+                    bias_rating=score.bias_rating,
+                    bias_flag=score.bias_flag,
+                )
+                if old is not None:
+                    self._store_aspects(
+                        cur, review["review_id"], old["teacher_id"], score.aspects
+                    )
+            if checkpoint is not None:
+                cur.execute(insert_table["set_checkpoint"], checkpoint)
+
+    def get_review_page(self, teacher_id, before=None, limit=REVIEW_PAGE_SIZE):
+        """Streams a page of a teacher's reviews, newest first
+        Args:
+            teacher_id (int): Teacher whose reviews are listed
+            before (int, optional): Only reviews with a smaller id, i.e. the
+            next_key of the previous page. Defaults to the first page.
+            limit (int, optional): Reviews per page. Defaults to
+            REVIEW_PAGE_SIZE.
+        Returns:
+            RecordPage: Page of rows keyed on review_id
+        """
+        if before is None and limit == REVIEW_PAGE_SIZE:
+            # The first page is what every profile view shows, it is served
+            # from the cache instead of streamed
+            rows = self.cache.get(
+                ("reviews", int(teacher_id)),
+                lambda: self.get_records(
+                    "get_review_page", (int(teacher_id), FIRST_PAGE, limit + 1)
                 ),
             )
-            review_id = cur.lastrowid
-            conn.commit()
-        return review_id
+            return RecordPage(iter(rows), limit, "review_id")
+        rows = self.iter_records(
+            "get_review_page",
+            (int(teacher_id), FIRST_PAGE if before is None else before, limit + 1),
+        )
+        return RecordPage(rows, limit, "review_id")
+
+    def get_aspect_summary(self, teacher_id, head="sentiment"):
+        """Aggregates the per-aspect scores of a teacher's reviews
+        Args:
+            teacher_id (int): Teacher
+            head (str, optional): "sentiment" or "bias". Defaults to "sentiment".
+        Returns:
+            arr: Per aspect, most mentioned first: mentions, mean label
+            (sentiment), positive, neutral and negative counts and mean
+            confidence
+        """
+        return self.cache.get(
+            ("aspects", int(teacher_id), head),
+            lambda: self.get_records("get_aspect_summary", (int(teacher_id), head)),
+        )
 
-    def get_review(self, teacher_id):
-        reviews = self.get_records("get_review", (int(teacher_id),))
-        return reviews
+    def get_review_aspects(self, review_id):
+        return self.get_records("get_review_aspects", (int(review_id),))
 
     def get_review_by_id(self, review_id):
         review_rating = self.get_record("get_review_by_id", (int(review_id),))
         return review_rating
 
     def delete_review(self, review_id):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute("DELETE FROM reviews WHERE id = ?", (int(review_id),))
-        conn.commit()
+        with self.transaction() as cur:
+            cur.execute(query_table["get_review_state"], (int(review_id),))
+            review = cur.fetchone()
+            if review is not None:
+                self._count_review(cur, review, -1)
+            cur.execute("DELETE FROM reviews WHERE id = ?", (int(review_id),))
+            cur.execute(
+                "DELETE FROM review_aspects WHERE review_id = ?", (int(review_id),)
+            )
+            cur.execute(
+                "DELETE FROM scoring_jobs WHERE review_id = ?", (int(review_id),)
+            )
 
     def update_review(self, review_id):
-        conn = self.get_conn()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE reviews SET reliable_flag = 'Unverified' WHERE id = ?",
-            (int(review_id),),
-        )
-        conn.commit()
+        with self.transaction() as cur:
+            self._change_review(cur, review_id, reliable_flag="Unverified")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument("command", choices=["migrate", "rebuild-stats", "check-plans"])
+    parser.add_argument("--db", default="test.db", help="path to the database")
+    args = parser.parse_args()
+
+    datastore = Datastore(args.db)
+    applied = datastore.tables_init()
+    if args.command == "migrate":
+        print(f"Applied migrations {applied}" if applied else "Already up to date")
+    elif args.command == "rebuild-stats":
+        datastore.rebuild_teacher_stats()
+        print("Rebuilt teacher stats")
+    else:
+        offending = datastore.check_query_plans()
+        for command, scans in offending.items():
+            print(f"{command}: {'; '.join(scans)}")
+        if offending:
+            sys.exit(1)
+        print("Every query uses an index")
@@ -0,0 +1,101 @@
+"""Bounds how much inference a process runs at once
+
+The models are shared by every thread of a process: the scoring worker, warm-up
+and, in the model server, every client connection. Forward passes of the eval
+models are safe to overlap, but each one spreads over torch's intra-op thread
+pool, so unbounded concurrency oversubscribes the cores. InferenceExecutor runs
+scoring on the calling thread once one of config.INFERENCE_CONCURRENCY slots is
+free, and configure_threads sizes torch's pools to config.TORCH_THREADS and
+config.TORCH_INTEROP_THREADS.
+
+Find the fastest combination for a host with
+
+    python -m benchmarks.inference --tune
+"""
+
+import threading
+import time
+
+from utils import config
+from utils.metrics import inference_seconds
+
+_threads_lock = threading.Lock()
+_threads = None
+
+
+def configure_threads(threads=None, interop_threads=None):
+    """Sizes torch's thread pools for this process. Without arguments, a size
+    configured earlier is kept.
+    Args:
+        threads (int, optional): Intra-op threads used by each forward pass.
+        Defaults to config.TORCH_THREADS.
+        interop_threads (int, optional): Inter-op threads. Defaults to
+        config.TORCH_INTEROP_THREADS.
+    Returns:
+        tup: (intra-op threads, inter-op threads) in effect
+    """
+    global _threads
+    import torch
+
+    with _threads_lock:
+        if _threads is not None and threads is None and interop_threads is None:
+            return _threads
+        torch.set_num_threads(threads or config.TORCH_THREADS)
+        # torch only accepts the inter-op size once per process, before any
+        # inter-op work started
+        try:
+            torch.set_num_interop_threads(
+                interop_threads or config.TORCH_INTEROP_THREADS
+            )
+        except RuntimeError:
+            pass
+        _threads = (torch.get_num_threads(), torch.get_num_interop_threads())
+        return _threads
+
+
+class InferenceExecutor:
+    """Runs inference on the calling thread, at most concurrency calls at a time
+
+    Callers beyond the limit wait for a slot; the wait is reported to
+    utils.metrics as the "wait" stage of the "executor" head.
+    """
+
+    def __init__(self, concurrency=None):
+        """
+        Args:
+            concurrency (int, optional): Calls allowed to run at once. Defaults
+            to config.INFERENCE_CONCURRENCY.
+        """
+        self.concurrency = max(1, concurrency or config.INFERENCE_CONCURRENCY)
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self.running = 0
+        self.waiting = 0
+
+    def run(self, fn, *args, **kwargs):
+        """Calls fn once a slot is free
+        Returns:
+            The return value of fn
+        """
+        started = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        with self._slots:
+            with self._lock:
+                self.waiting -= 1
+                self.running += 1
+            inference_seconds.observe(time.perf_counter() - started, "executor", "wait")
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+    def stats(self):
+        """Retrieves the concurrency limit and the calls running and waiting"""
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "running": self.running,
+                "waiting": self.waiting,
+            }
@@ -0,0 +1,290 @@
+"""Shared model server for every web worker on the host
+
+The server process holds the only copy of the models and answers scoring
+requests over a Unix socket. Each request and response is a single line of JSON:
+
+    {"reviews": ["...", "..."]}  ->  {"scores": [[<ReviewScore fields>], ...]}
+
+Start it with ``python -m utils.inference_server``. InferenceClient falls back to
+in-process models when no server is listening.
+
+Only the user running the app may talk to the server. The socket lives in a
+directory nobody else can write to, and both ends check the other's uid with
+SO_PEERCRED where the platform has it.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import threading
+import time
+
+from prototype.scorer import ReviewScore
+from utils import config
+from utils.inference_executor import InferenceExecutor, configure_threads
+from utils.prediction_cache import PredictionCache
+
+log = logging.getLogger("rapportcard.inference")
+
+# Mentions several aspects so that warm-up touches every part of the pipeline
+WARM_UP_REVIEW = "The teacher explains the exam and the grading clearly."
+
+
+class LocalScorer:
+    """Scores reviews with the sentiment and bias heads in this process"""
+
+    # Bump when aspect detection, the way labels are collapsed into ratings or
+    # the fields of ReviewScore change
+    SCORING_VERSION = 5
+
+    def __init__(self, cache=None, executor=None):
+        """
+        Args:
+            cache (PredictionCache, optional): Cache of previous scores.
+            Defaults to one backed by config.PREDICTION_CACHE.
+            executor (InferenceExecutor, optional): Bounds concurrent scoring.
+            Defaults to config.INFERENCE_CONCURRENCY batches at a time.
+        """
+        from prototype import artifacts
+        from prototype.scorer import ReviewScorer
+
+        # Before the models load, so that torch sizes its pools only once
+        configure_threads()
+        self.scorer = ReviewScorer()
+        self.executor = executor if executor is not None else InferenceExecutor()
+        if cache is None:
+            cache = PredictionCache(
+                config.PREDICTION_CACHE or None,
+                config.PREDICTION_CACHE_SIZE,
+                config.PREDICTION_CACHE_DAYS * 86400,
+            )
+        self.cache = cache
+        self.version = "|".join(
+            [
+                str(self.SCORING_VERSION),
+                artifacts.embedding_model(),
+                self.scorer.version,
+            ]
+        )
+
+    def score(self, reviews):
+        """Scores review texts, skipping inference for reviews already scored
+        Args:
+            reviews (list): Review texts
+        Returns:
+            arr: ReviewScore per review
+        """
+        # Aspects are detected once, for the cache key and for inference
+        matches = [self.scorer.find(review) for review in reviews]
+        keys = [
+            PredictionCache.key(
+                review,
+                list(dict.fromkeys(match.aspect for match in review_matches)),
+                self.version,
+            )
+            for review, review_matches in zip(reviews, matches)
+        ]
+        scores = self.cache.get_many(keys)
+        # Duplicates within the batch are only scored once
+        missing = {}
+        for key, review, review_matches in zip(keys, reviews, matches):
+            if key not in scores:
+                missing.setdefault(key, (review, review_matches))
+        if missing:
+            texts, text_matches = zip(*missing.values())
+            fresh = dict(
+                zip(missing, self.executor.run(self.scorer.score, texts, text_matches))
+            )
+            self.cache.put_many(fresh)
+            scores.update(fresh)
+        return [ReviewScore(*scores[key]) for key in keys]
+
+
+def check_socket_dir(socket_path, create=False):
+    """Makes sure nobody but this user can replace the socket
+    Args:
+        socket_path (str): Path of the Unix socket
+        create (bool, optional): Create a missing directory with mode 0700.
+        Defaults to False.
+    Raises:
+        PermissionError: If the directory belongs to another user or is group
+        or world-writable
+    """
+    directory = os.path.dirname(os.path.abspath(socket_path))
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(
+            f"{directory} must belong to uid {os.getuid()} and be writable by "
+            f"nobody else, e.g. mode 0700, to hold the inference socket"
+        )
+
+
+def check_peer(conn):
+    """Makes sure the other end of a Unix socket runs as this user
+    Args:
+        conn (socket.socket): Connected Unix socket
+    Raises:
+        PermissionError: If the peer runs as another user
+    """
+    if not hasattr(socket, "SO_PEERCRED"):
+        # Only Linux reports peer credentials; check_socket_dir still applies
+        return
+    credentials = conn.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+    )
+    _, uid, _ = struct.unpack("3i", credentials)
+    if uid != os.getuid():
+        raise PermissionError(f"Inference socket peer runs as uid {uid}")
+
+
+class InferenceClient:
+    """Scores reviews through the model server, or in-process without one"""
+
+    def __init__(self, socket_path=config.INFERENCE_SOCKET, timeout=120):
+        """
+        Args:
+            socket_path (str, optional): Unix socket of the model server.
+            Defaults to config.INFERENCE_SOCKET.
+            timeout (float, optional): Seconds to wait for a response.
+            Defaults to 120.
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = None
+        self._lock = threading.Lock()
+
+    def local(self):
+        """Retrieves the in-process scorer, loading the models on first use"""
+        with self._lock:
+            if self._local is None:
+                started = time.perf_counter()
+                self._local = LocalScorer()
+                log.info("Loaded models in %.2fs", time.perf_counter() - started)
+            return self._local
+
+    def warm_up(self):
+        """Runs a throwaway prediction so the first review is not slowed down by
+        model loading, either on the model server or in this process
+        Returns:
+            float: Seconds taken
+        """
+        started = time.perf_counter()
+        self.score([WARM_UP_REVIEW])
+        return time.perf_counter() - started
+
+    def score(self, reviews):
+        """Scores review texts, see LocalScorer.score"""
+        try:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            conn.close()
+            return self.local().score(reviews)
+
+        with conn:
+            # Reviews must not go to a server another user put on the path
+            check_peer(conn)
+            with conn.makefile("rwb") as stream:
+                stream.write(json.dumps({"reviews": reviews}).encode() + b"\n")
+                stream.flush()
+                response = json.loads(stream.readline())
+        if "error" in response:
+            raise RuntimeError(f"Inference server failed: {response['error']}")
+        return [ReviewScore(*score) for score in response["scores"]]
+
+
+class InferenceHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            reviews = json.loads(line)["reviews"]
+            response = {"scores": self.server.scorer.score(reviews)}
+        except Exception as e:
+            response = {"error": repr(e)}
+        self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class InferenceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, scorer):
+        """
+        Args:
+            socket_path (str): Path of the Unix socket to listen on
+            scorer (LocalScorer): Scorer holding the models
+        Raises:
+            PermissionError: If other users could replace the socket, see
+            check_socket_dir
+            FileExistsError: If something other than a socket is at socket_path
+        """
+        check_socket_dir(socket_path, create=True)
+        if os.path.lexists(socket_path):
+            # Left behind by a server that did not shut down cleanly
+            if not stat.S_ISSOCK(os.lstat(socket_path).st_mode):
+                raise FileExistsError(f"{socket_path} exists and is not a socket")
+            os.unlink(socket_path)
+        # Connections share the models; the scorer's executor bounds how many
+        # batches run at once
+        self.scorer = scorer
+        super().__init__(socket_path, InferenceHandler)
+
+    def verify_request(self, request, client_address):
+        try:
+            check_peer(request)
+        except PermissionError as e:
+            log.warning("Refused connection: %s", e)
+            return False
+        return True
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the review models")
+    parser.add_argument("--socket", default=config.INFERENCE_SOCKET)
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=config.TORCH_THREADS,
+        help="intra-op threads per batch",
+    )
+    parser.add_argument(
+        "--interop-threads", type=int, default=config.TORCH_INTEROP_THREADS
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=config.INFERENCE_CONCURRENCY,
+        help="batches scored at once",
+    )
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    threads, interop_threads = configure_threads(args.threads, args.interop_threads)
+    scorer = LocalScorer(executor=InferenceExecutor(args.concurrency))
+    scorer.score([WARM_UP_REVIEW])
+    print(f"Loaded and warmed up models in {time.perf_counter() - started:.2f}s")
+    print(
+        f"Scoring {args.concurrency} batches at once on {threads} intra-op and "
+        f"{interop_threads} inter-op threads"
+    )
+
+    with InferenceServer(args.socket, scorer) as server:
+        print(f"Serving models on {args.socket}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
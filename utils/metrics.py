@@ -0,0 +1,197 @@
+"""Timing instrumentation rendered in the Prometheus text format
+
+Histograms live in a process-wide registry and are served by the /metrics
+route. Each gunicorn worker reports its own, so scrape every worker or
+aggregate by instance. Requests slower than config.SLOW_REQUEST_SECONDS are
+also logged to the rapportcard.slow logger with their query count and time.
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds in seconds, from a cached lookup to a cold model load
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_log = logging.getLogger("rapportcard.slow")
+
+_request = threading.local()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """Cumulative histogram of durations per combination of label values"""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        """Records one duration
+        Args:
+            seconds (float): Duration
+            *labels (str): One value per label name, in order
+        """
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            counts, _, _ = series
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def snapshot(self):
+        """Retrieves the count and sum of every series
+        Returns:
+            dict: (count, sum) per tuple of label values
+        """
+        with self._lock:
+            return {
+                labels: (count, total)
+                for labels, (_, total, count) in self._series.items()
+            }
+
+    @contextmanager
+    def time(self, *labels):
+        """Times the block and records it under the given label values"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for labels, (counts, total, count) in series:
+                for bound, bucket_count in zip(self.buckets, counts):
+                    bucket_labels = _labels(self.labelnames, labels, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{bucket_labels} {bucket_count}")
+                inf_labels = _labels(self.labelnames, labels, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{inf_labels} {count}")
+                plain = _labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{plain} {total}")
+                lines.append(f"{self.name}_count{plain} {count}")
+        return "\n".join(lines)
+
+
+request_seconds = Histogram(
+    "rapportcard_request_seconds",
+    "Time spent handling HTTP requests",
+    ["route", "method", "status"],
+)
+query_seconds = Histogram(
+    "rapportcard_query_seconds",
+    "Time spent executing SQLite queries, by query_table key",
+    ["query"],
+)
+inference_seconds = Histogram(
+    "rapportcard_inference_seconds",
+    "Time spent in each inference stage: tokenize (aspect matching and input "
+    "building), embed (indexing and the BERT pass), gcn and postprocess, and "
+    "waiting for an executor slot (head executor, stage wait)",
+    ["head", "stage"],
+)
+
+write_lock_seconds = Histogram(
+    "rapportcard_write_lock_seconds",
+    "Time spent waiting for the SQLite write lock when a transaction begins",
+)
+
+HISTOGRAMS = [request_seconds, query_seconds, inference_seconds, write_lock_seconds]
+
+
+def render(extra=()):
+    """Renders every histogram in the Prometheus text format
+    Args:
+        extra (list, optional): Further rendered metric families to append
+    Returns:
+        str: Exposition text
+    """
+    return "\n".join([*(h.render() for h in HISTOGRAMS), *extra]) + "\n"
+
+
+def counter_family(name, documentation, labelnames, samples):
+    """Renders counters kept elsewhere, such as RecordCache.stats()
+    Args:
+        name (str): Metric name
+        documentation (str): Help text
+        labelnames (list): Label names
+        samples (list): (label values, value) pairs
+    Returns:
+        str: Exposition text
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} counter"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(labelnames, labels)} {value}")
+    return "\n".join(lines)
+
+
+def start_request():
+    """Starts collecting the query time of the request on this thread"""
+    _request.queries = 0
+    _request.query_seconds = 0.0
+
+
+def record_query(command, seconds):
+    """Records a query, counting it towards the current request"""
+    query_seconds.observe(seconds, command)
+    if getattr(_request, "queries", None) is not None:
+        _request.queries += 1
+        _request.query_seconds += seconds
+
+
+@contextmanager
+def time_query(command):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_query(command, time.perf_counter() - started)
+
+
+def finish_request(route, method, status, seconds, threshold):
+    """Records a request, logging it if it took at least threshold seconds
+    Args:
+        route (str): URL rule that handled the request
+        method (str): HTTP method
+        status (int): Response status code
+        seconds (float): Time spent handling it
+        threshold (float): Slow request threshold, 0 to never log
+    """
+    request_seconds.observe(seconds, route, method, str(status))
+    queries = getattr(_request, "queries", None) or 0
+    spent = getattr(_request, "query_seconds", 0.0)
+    _request.queries = None
+    if threshold and seconds >= threshold:
+        slow_log.warning(
+            "slow request route=%s method=%s status=%s ms=%.1f queries=%d query_ms=%.1f",
+            route,
+            method,
+            status,
+            seconds * 1000,
+            queries,
+            spent * 1000,
+        )
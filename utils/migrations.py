@@ -0,0 +1,318 @@
+"""Versioned schema migrations
+
+The schema version of a database is kept in PRAGMA user_version. migrate()
+applies every migration newer than it in order, each in its own transaction, so
+the schema can evolve on databases that already hold data. Add new migrations
+to the end of the migrations list and never edit applied ones.
+"""
+
+import sqlite3
+
+init_table = {
+    "teachers": """
+        CREATE TABLE IF NOT EXISTS teachers (
+            id INTEGER PRIMARY KEY,
+            name TEXT,
+            school_id INTEGER,
+            FOREIGN KEY(school_id) REFERENCES schools(id)
+        );
+    """,
+    "users": """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            password TEXT
+        );
+    """,
+    "reviews": """
+        CREATE TABLE IF NOT EXISTS reviews (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            teacher_id INTEGER,
+            user_id INTEGER,
+            rating INTEGER,
+            comment TEXT,
+            flag TEXT,
+            bias_rating INTEGER,
+            bias_flag TEXT,
+            reliable_flag TEXT,
+            FOREIGN KEY(teacher_id) REFERENCES teachers(id),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        );
+    """,
+    "schools": """
+        CREATE TABLE IF NOT EXISTS schools (
+            id INTEGER PRIMARY KEY,
+            name TEXT
+        );
+    """,
+    "scoring_jobs": """
+        CREATE TABLE IF NOT EXISTS scoring_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            review_id INTEGER,
+            status TEXT DEFAULT 'queued',
+            attempts INTEGER DEFAULT 0,
+            claimed_at REAL,
+            FOREIGN KEY(review_id) REFERENCES reviews(id)
+        );
+    """,
+    "teacher_stats": """
+        CREATE TABLE IF NOT EXISTS teacher_stats (
+            teacher_id INTEGER PRIMARY KEY,
+            review_count INTEGER DEFAULT 0,
+            rating_sum INTEGER DEFAULT 0,
+            biased_count INTEGER DEFAULT 0,
+            unverified_count INTEGER DEFAULT 0,
+            pending_count INTEGER DEFAULT 0,
+            rating_1 INTEGER DEFAULT 0,
+            rating_2 INTEGER DEFAULT 0,
+            rating_3 INTEGER DEFAULT 0,
+            rating_4 INTEGER DEFAULT 0,
+            rating_5 INTEGER DEFAULT 0,
+            FOREIGN KEY(teacher_id) REFERENCES teachers(id)
+        );
+    """,
+    # One row per aspect occurrence and head of a scored review. teacher_id is
+    # copied from the review so per-teacher aggregates need no join.
+    "review_aspects": """
+        CREATE TABLE IF NOT EXISTS review_aspects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            review_id INTEGER,
+            teacher_id INTEGER,
+            head TEXT,
+            aspect TEXT,
+            label INTEGER,
+            confidence REAL,
+            FOREIGN KEY(review_id) REFERENCES reviews(id),
+            FOREIGN KEY(teacher_id) REFERENCES teachers(id)
+        );
+    """,
+    "bulk_checkpoints": """
+        CREATE TABLE IF NOT EXISTS bulk_checkpoints (
+            name TEXT PRIMARY KEY,
+            position INTEGER DEFAULT 0
+        );
+    """,
+}
+
+index_table = {
+    "idx_users_username": """
+        CREATE INDEX IF NOT EXISTS idx_users_username ON users (username);
+    """,
+    # Covers get_review_page: rows of a teacher come out in id order with every
+    # selected column, so neither the table nor a sort is needed
+    "idx_reviews_teacher": """
+        CREATE INDEX IF NOT EXISTS idx_reviews_teacher ON reviews (
+            teacher_id, id, user_id, rating, flag, bias_rating, bias_flag,
+            reliable_flag, comment
+        );
+    """,
+    "idx_reviews_user": """
+        CREATE INDEX IF NOT EXISTS idx_reviews_user ON reviews (user_id);
+    """,
+    "idx_scoring_jobs_status": """
+        CREATE INDEX IF NOT EXISTS idx_scoring_jobs_status ON scoring_jobs (status, claimed_at);
+    """,
+    "idx_scoring_jobs_review": """
+        CREATE INDEX IF NOT EXISTS idx_scoring_jobs_review ON scoring_jobs (review_id);
+    """,
+}
+
+aspect_index_table = {
+    # Covers get_aspect_summary, so aspect dashboards never touch the table
+    "idx_review_aspects_teacher": """
+        CREATE INDEX IF NOT EXISTS idx_review_aspects_teacher ON review_aspects (
+            teacher_id, head, aspect, label, confidence
+        );
+    """,
+    "idx_review_aspects_review": """
+        CREATE INDEX IF NOT EXISTS idx_review_aspects_review ON review_aspects (review_id);
+    """,
+}
+
+# Word-prefix index ranked by bm25, and a trigram index for fuzzy matching.
+# Triggers keep both in sync with teachers and schools.
+search_table = {
+    "teacher_fts": """
+        CREATE VIRTUAL TABLE IF NOT EXISTS teacher_fts USING fts5(
+            name, school, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        );
+    """,
+    "teacher_trigram": """
+        CREATE VIRTUAL TABLE IF NOT EXISTS teacher_trigram USING fts5(
+            name, school, tokenize = 'trigram'
+        );
+    """,
+    "idx_teachers_school": """
+        CREATE INDEX IF NOT EXISTS idx_teachers_school ON teachers (school_id);
+    """,
+    "idx_teachers_name": """
+        CREATE INDEX IF NOT EXISTS idx_teachers_name ON teachers (name);
+    """,
+    "teachers_search_insert": """
+        CREATE TRIGGER IF NOT EXISTS teachers_search_insert AFTER INSERT ON teachers
+        BEGIN
+            INSERT INTO teacher_fts (rowid, name, school)
+            VALUES (new.id, new.name, (SELECT name FROM schools WHERE id = new.school_id));
+            INSERT INTO teacher_trigram (rowid, name, school)
+            VALUES (new.id, new.name, (SELECT name FROM schools WHERE id = new.school_id));
+        END;
+    """,
+    "teachers_search_update": """
+        CREATE TRIGGER IF NOT EXISTS teachers_search_update AFTER UPDATE ON teachers
+        BEGIN
+            DELETE FROM teacher_fts WHERE rowid = old.id;
+            DELETE FROM teacher_trigram WHERE rowid = old.id;
+            INSERT INTO teacher_fts (rowid, name, school)
+            VALUES (new.id, new.name, (SELECT name FROM schools WHERE id = new.school_id));
+            INSERT INTO teacher_trigram (rowid, name, school)
+            VALUES (new.id, new.name, (SELECT name FROM schools WHERE id = new.school_id));
+        END;
+    """,
+    "teachers_search_delete": """
+        CREATE TRIGGER IF NOT EXISTS teachers_search_delete AFTER DELETE ON teachers
+        BEGIN
+            DELETE FROM teacher_fts WHERE rowid = old.id;
+            DELETE FROM teacher_trigram WHERE rowid = old.id;
+        END;
+    """,
+    "schools_search_insert": """
+        CREATE TRIGGER IF NOT EXISTS schools_search_insert AFTER INSERT ON schools
+        BEGIN
+            UPDATE teacher_fts SET school = new.name
+            WHERE rowid IN (SELECT id FROM teachers WHERE school_id = new.id);
+            UPDATE teacher_trigram SET school = new.name
+            WHERE rowid IN (SELECT id FROM teachers WHERE school_id = new.id);
+        END;
+    """,
+    "schools_search_update": """
+        CREATE TRIGGER IF NOT EXISTS schools_search_update AFTER UPDATE OF name ON schools
+        BEGIN
+            UPDATE teacher_fts SET school = new.name
+            WHERE rowid IN (SELECT id FROM teachers WHERE school_id = new.id);
+            UPDATE teacher_trigram SET school = new.name
+            WHERE rowid IN (SELECT id FROM teachers WHERE school_id = new.id);
+        END;
+    """,
+}
+
+REBUILD_TEACHER_SEARCH = [
+    "DELETE FROM teacher_fts;",
+    "DELETE FROM teacher_trigram;",
+    """
+    INSERT INTO teacher_fts (rowid, name, school)
+    SELECT teachers.id, teachers.name, schools.name
+    FROM teachers
+    LEFT JOIN schools ON schools.id = teachers.school_id;
+    """,
+    """
+    INSERT INTO teacher_trigram (rowid, name, school)
+    SELECT teachers.id, teachers.name, schools.name
+    FROM teachers
+    LEFT JOIN schools ON schools.id = teachers.school_id;
+    """,
+]
+
+REBUILD_TEACHER_STATS = """
+
+    INSERT INTO teacher_stats (teacher_id, review_count, rating_sum, biased_count, unverified_count, pending_count, rating_1, rating_2, rating_3, rating_4, rating_5)
+    SELECT teacher_id,
+        sum(flag IS NOT 'Pending'),
+        coalesce(sum(CASE WHEN flag IS NOT 'Pending' THEN rating END), 0),
+        sum(flag IS NOT 'Pending' AND bias_flag = 'Biased'),
+        sum(flag IS NOT 'Pending' AND reliable_flag = 'Unverified'),
+        sum(flag IS 'Pending'),
+        sum(flag IS NOT 'Pending' AND rating = 1),
+        sum(flag IS NOT 'Pending' AND rating = 2),
+        sum(flag IS NOT 'Pending' AND rating = 3),
+        sum(flag IS NOT 'Pending' AND rating = 4),
+        sum(flag IS NOT 'Pending' AND rating = 5)
+    FROM reviews
+    GROUP BY teacher_id;
+    """
+
+# Duplicates left by racing signups keep their reviews under a renamed account
+UNIQUE_USERNAMES = [
+    """
+    UPDATE users SET username = username || '#' || id
+    WHERE id NOT IN (SELECT min(id) FROM users GROUP BY username);
+    """,
+    "DROP INDEX IF EXISTS idx_users_username;",
+    "CREATE UNIQUE INDEX idx_users_username ON users (username);",
+]
+
+# (version, description, statements)
+migrations = [
+    (
+        1,
+        "Initial schema",
+        [
+            init_table["teachers"],
+            init_table["users"],
+            init_table["reviews"],
+            init_table["schools"],
+        ],
+    ),
+    (2, "Scoring queue", [init_table["scoring_jobs"]]),
+    (
+        3,
+        "Teacher stats",
+        [
+            init_table["teacher_stats"],
+            "DELETE FROM teacher_stats;",
+            REBUILD_TEACHER_STATS,
+        ],
+    ),
+    (4, "Indexes for lookups by user, teacher and job", list(index_table.values())),
+    (
+        5,
+        "Full-text teacher search",
+        list(search_table.values()) + REBUILD_TEACHER_SEARCH,
+    ),
+    (6, "Bulk import and rescoring checkpoints", [init_table["bulk_checkpoints"]]),
+    # Reviews scored before this migration have no aspect rows until they are
+    # rescored with python -m utils.bulk rescore
+    (
+        7,
+        "Per-aspect scores",
+        [init_table["review_aspects"], *aspect_index_table.values()],
+    ),
+    (8, "Unique usernames", UNIQUE_USERNAMES),
+]
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    cur = conn.cursor()
+    # Independent of the row factory the connection was set up with
+    cur.row_factory = None
+    return cur.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target=None):
+    """Brings a database up to date
+    Args:
+        conn (sqlite3.Connection): Connection to the database
+        target (int, optional): Version to stop at. Defaults to the latest.
+    Returns:
+        arr: Versions applied
+    """
+    applied = []
+    for version, description, statements in migrations:
+        if target is not None and version > target:
+            break
+        if schema_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the lock
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+        applied.append(version)
+    return applied
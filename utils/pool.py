@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import threading
+
+
+class ConnectionPool:
+    """Keeps configured SQLite connections around between uses
+
+    Connections are set up once (WAL journal, synchronous=NORMAL, busy timeout
+    and a prepared statement cache) and reused by whichever thread acquires them
+    next. Up to size idle connections are kept; extra ones are closed on
+    release, so acquiring never blocks.
+    """
+
+    def __init__(
+        self,
+        uri,
+        size=8,
+        busy_timeout=5.0,
+        cached_statements=256,
+        row_factory=None,
+    ):
+        """
+        Args:
+            uri (str): Database file
+            size (int, optional): Idle connections kept. Defaults to 8.
+            busy_timeout (float, optional): Seconds to wait for a lock.
+            Defaults to 5.0.
+            cached_statements (int, optional): Prepared statements cached per
+            connection. Defaults to 256.
+            row_factory (callable, optional): Row factory of every connection
+        """
+        self.uri = uri
+        self.size = size
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self.row_factory = row_factory
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.uri,
+            timeout=self.busy_timeout,
+            cached_statements=self.cached_statements,
+            # Pooled connections move between threads, one user at a time
+            check_same_thread=False,
+        )
+        conn.row_factory = self.row_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Connections must not cross a fork, forget the parent's
+                self._idle = []
+                self._pid = os.getpid()
+            if self._idle:
+                return self._idle.pop()
+        return self.connect()
+
+    def release(self, conn):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Opened before a fork, leave it to the parent
+                return
+            if conn.in_transaction:
+                conn.rollback()
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+init_cache = """
+    CREATE TABLE IF NOT EXISTS prediction_cache (
+        key TEXT PRIMARY KEY,
+        score TEXT,
+        created_at REAL
+    );
+    CREATE INDEX IF NOT EXISTS idx_prediction_cache_created ON prediction_cache (created_at);
+"""
+
+# Seconds between prunes of the persistent tier by one process
+PRUNE_INTERVAL = 3600
+
+
+def normalize(text):
+    """Normalizes review text the way the models see it"""
+    return " ".join(text.lower().split())
+
+
+class PredictionCache:
+    """Two-tier cache of review scores keyed on review content
+
+    Lookups go to an in-memory LRU first and then to a SQLite table, so repeated
+    submissions skip inference in every process sharing the cache file. Rows
+    older than max_age are deleted when the cache opens and then at most hourly,
+    which also drops the scores of model versions no longer in use.
+    """
+
+    def __init__(self, path, capacity=4096, max_age=None):
+        """
+        Args:
+            path (str): SQLite file for the persistent tier, or None to keep the
+            cache in memory only
+            capacity (int, optional): Entries kept in memory. Defaults to 4096.
+            max_age (float, optional): Seconds a score is kept on disk. Defaults
+            to keeping it forever.
+        """
+        self.path = path
+        self.capacity = capacity
+        self.max_age = max_age
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pruned_at = 0.0
+        if self.path:
+            conn = self.get_conn()
+            conn.executescript(init_cache)
+            conn.commit()
+            self.prune()
+
+    @staticmethod
+    def key(text, aspects, model_version):
+        """Builds the cache key of a review
+        Args:
+            text (str): Review text
+            aspects (list): Aspects found in the review
+            model_version (str): Version of the models scoring it
+        Returns:
+            str: Hex digest identifying the prediction
+        """
+        payload = json.dumps([normalize(text), sorted(aspects), model_version])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_conn(self) -> sqlite3.Connection:
+        # sqlite3 connections cannot be shared between threads
+        if getattr(self._local, "conn", None) is None:
+            self._local.conn = sqlite3.connect(self.path, timeout=5)
+        return self._local.conn
+
+    def get_many(self, keys):
+        """Looks keys up in memory, then on disk
+        Args:
+            keys (list): Cache keys
+        Returns:
+            dict: Cached score for every key found
+        """
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+        missing = [key for key in set(keys) if key not in found]
+        if self.path and missing:
+            placeholders = ",".join("?" * len(missing))
+            rows = (
+                self.get_conn()
+                .execute(
+                    f"SELECT key, score FROM prediction_cache WHERE key IN ({placeholders})",
+                    missing,
+                )
+                .fetchall()
+            )
+            disk = {key: tuple(json.loads(score)) for key, score in rows}
+            self._remember(disk)
+            found.update(disk)
+        return found
+
+    def put_many(self, scores):
+        """Stores scores in both tiers
+        Args:
+            scores (dict): Score per cache key
+        """
+        self._remember(scores)
+        if self.path and scores:
+            conn = self.get_conn()
+            now = time.time()
+            conn.executemany(
+                "INSERT OR REPLACE INTO prediction_cache (key, score, created_at) VALUES (?, ?, ?)",
+                [(key, json.dumps(score), now) for key, score in scores.items()],
+            )
+            conn.commit()
+            if now - self._pruned_at >= PRUNE_INTERVAL:
+                self.prune()
+
+    def prune(self):
+        """Deletes the rows of the persistent tier older than max_age
+        Returns:
+            int: Rows deleted
+        """
+        self._pruned_at = time.time()
+        if not self.path or not self.max_age:
+            return 0
+        conn = self.get_conn()
+        cur = conn.execute(
+            "DELETE FROM prediction_cache WHERE created_at < ?",
+            (self._pruned_at - self.max_age,),
+        )
+        conn.commit()
+        return cur.rowcount
+
+    def _remember(self, scores):
+        with self._lock:
+            for key, score in scores.items():
+                self._memory[key] = score
+                self._memory.move_to_end(key)
+            while len(self._memory) > self.capacity:
+                self._memory.popitem(last=False)
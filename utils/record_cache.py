@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecordCache:
+    """In-memory read-through cache of database records with TTL and LRU eviction
+
+    Keys are tuples whose first element names the kind of record, e.g.
+    ("teacher", 3), which is also what hits and misses are counted by. Every
+    process keeps its own cache: writers invalidate their own entries, and the
+    TTL bounds how long another process can serve a stale one.
+    """
+
+    def __init__(self, capacity=2048, ttl=30.0):
+        """
+        Args:
+            capacity (int, optional): Entries kept. Defaults to 2048.
+            ttl (float, optional): Seconds an entry is served for. Defaults to
+            30.0. 0 disables the cache.
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {}
+        # Bumped by every invalidation, so a record loaded while a write
+        # committed is not cached
+        self._generation = 0
+
+    def _count(self, kind, event):
+        counters = self._counters.setdefault(
+            kind, {"hits": 0, "misses": 0, "expired": 0, "evicted": 0}
+        )
+        counters[event] += 1
+
+    def get(self, key, load, cache_missing=True):
+        """Retrieves a record, loading and caching it on a miss
+        Args:
+            key (tup): Cache key
+            load (callable): Loads the record when it is not cached
+            cache_missing (bool, optional): Whether a None record is cached too.
+            Defaults to True.
+        Returns:
+            The cached or loaded record
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._count(key[0], "hits")
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+                self._count(key[0], "expired")
+            self._count(key[0], "misses")
+            generation = self._generation
+
+        value = load()
+        if self.ttl <= 0 or (value is None and not cache_missing):
+            return value
+        with self._lock:
+            if generation != self._generation:
+                return value
+            self._entries[key] = (now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                evicted, _ = self._entries.popitem(last=False)
+                self._count(evicted[0], "evicted")
+        return value
+
+    def invalidate(self, *keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def invalidate_kind(self, kind):
+        """Drops every entry of one kind of record"""
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if key[0] == kind]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        """Retrieves hit, miss, expiry and eviction counts per kind of record
+        Returns:
+            dict: Counters by kind, plus the number of entries under "size"
+        """
+        with self._lock:
+            stats = {kind: dict(counters) for kind, counters in self._counters.items()}
+            stats["size"] = len(self._entries)
+        return stats
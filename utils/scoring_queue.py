@@ -0,0 +1,127 @@
+import argparse
+import threading
+import time
+import traceback
+
+
+class ScoringWorker(threading.Thread):
+    """Background thread that scores queued reviews in micro-batches
+
+    Reviews are queued by Datastore.add_review into the scoring_jobs table, so
+    any process sharing the database can run a worker. Claiming is atomic, which
+    lets every gunicorn worker run its own thread against the same queue.
+    """
+
+    def __init__(
+        self,
+        db,
+        batch_size=16,
+        max_wait=0.05,
+        poll_interval=1.0,
+        max_attempts=3,
+        stale_after=300,
+    ):
+        """
+        Args:
+            db (Datastore): Datastore holding the queue and the predictors
+            batch_size (int, optional): Maximum reviews per forward pass.
+            Defaults to 16.
+            max_wait (float, optional): Seconds to wait after a wake-up so that
+            concurrent submissions share a batch. Defaults to 0.05.
+            poll_interval (float, optional): Seconds between polls for jobs queued
+            by other processes. Defaults to 1.0.
+            max_attempts (int, optional): Attempts before a review keeps its
+            manual rating. Defaults to 3.
+            stale_after (float, optional): Seconds after which a claimed job is
+            considered abandoned. Defaults to 300.
+        """
+        super().__init__(name="scoring-worker", daemon=True)
+        self.db = db
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.stale_after = stale_after
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+
+    def notify(self):
+        """Wakes the worker up after a review was queued in this process"""
+        self._wakeup.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            if self._wakeup.wait(self.poll_interval):
+                self._wakeup.clear()
+                time.sleep(self.max_wait)
+            try:
+                while self.process_batch():
+                    pass
+            except Exception:
+                # Keep the worker alive if the database is briefly unavailable
+                traceback.print_exc()
+
+    def process_batch(self):
+        """Claims and scores a single micro-batch
+        Returns:
+            bool: Whether any job was processed
+        """
+        jobs = self.db.claim_jobs(self.batch_size, self.stale_after)
+        if not jobs:
+            return False
+        try:
+            scores = self.db.score_reviews([job["review"] for job in jobs])
+        except Exception:
+            traceback.print_exc()
+            if len(jobs) == 1:
+                self.db.fail_jobs(jobs, self.max_attempts)
+                return True
+            # One review the models cannot take fails the whole batch, so the
+            # jobs are scored one at a time and only the failing ones are retried
+            scored = []
+            for job in jobs:
+                try:
+                    scored.append((job, self.db.score_reviews([job["review"]])[0]))
+                except Exception:
+                    traceback.print_exc()
+                    self.db.fail_jobs([job], self.max_attempts)
+            if not scored:
+                return True
+            jobs, scores = [list(column) for column in zip(*scored)]
+        self.complete(jobs, scores)
+        return True
+
+    def complete(self, jobs, scores):
+        """Stores the scores of jobs, retrying the failing ones later"""
+        try:
+            self.db.complete_jobs(jobs, scores)
+        except Exception:
+            traceback.print_exc()
+            if len(jobs) == 1:
+                self.db.fail_jobs(jobs, self.max_attempts)
+                return
+            # One bad review rolls the whole batch back, so the jobs are
+            # completed one at a time and only the failing ones are retried
+            for job, score in zip(jobs, scores):
+                try:
+                    self.db.complete_jobs([job], [score])
+                except Exception:
+                    traceback.print_exc()
+                    self.db.fail_jobs([job], self.max_attempts)
+
+
+if __name__ == "__main__":
+    from utils.datastore import Datastore
+
+    parser = argparse.ArgumentParser(description="Score queued reviews")
+    parser.add_argument("--db", default="test.db", help="path to the database")
+    parser.add_argument("--batch-size", type=int, default=16)
+    args = parser.parse_args()
+
+    datastore = Datastore(args.db)
+    datastore.tables_init()
+    ScoringWorker(datastore, batch_size=args.batch_size).run()
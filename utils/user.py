@@ -1,16 +1,23 @@
-from flask_login import UserMixin
+import time
 
 
-class User(UserMixin):
-    def __init__(self, user_id, username, password):
+class User:
+    """The logged in user as Flask-Login sees it
+
+    A User is built on every authenticated request, usually from the session
+    payload rather than the database, so it keeps its attributes in slots instead
+    of a per-instance dict. flask_login.UserMixin is not used as a base since it
+    would bring the dict back.
+    """
+
+    __slots__ = ("id", "username", "password", "authenticated")
+
+    def __init__(self, user_id, username, password=None):
         self.id = user_id
         self.username = username
         self.password = password
         self.authenticated = False
 
-    def is_active(self):
-        return self.is_active()
-
     def is_anonymous(self):
         return False
 
@@ -22,3 +29,38 @@ class User(UserMixin):
 
     def get_id(self):
         return self.id
+
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.id == other.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def to_session(self):
+        """Compact form kept in Flask's signed session cookie. The cookie is
+        signed but not encrypted, so the password is left out.
+        Returns:
+            arr: [id, username, issued at]
+        """
+        return [self.id, self.username, int(time.time())]
+
+    @classmethod
+    def from_session(cls, payload, user_id, max_age):
+        """Rebuilds a user from to_session output without querying the database
+        Args:
+            payload (list): Output of to_session, or None
+            user_id (str): Id Flask-Login stored in the session
+            max_age (float): Seconds a payload is trusted before the user is read
+            from the database again
+        Returns:
+            User: The user, or None if the payload is missing, of another user or
+            expired
+        """
+        if not payload or len(payload) != 3:
+            return None
+        payload_id, username, issued = payload
+        if str(payload_id) != str(user_id) or time.time() - issued >= max_age:
+            return None
+        return cls(payload_id, username)